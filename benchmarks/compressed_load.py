@@ -0,0 +1,66 @@
+"""Time the save and load of a synthetic state, plain and compressed.
+
+Usage: python compressed_load.py [-n TABLES] [-d DIRECTORY] [--cold]
+
+The state is saved once in each format to the DIRECTORY (a temporary one by
+default), and then loaded a few times without the state cache; the size of
+each file and the best times are reported. Point the DIRECTORY at a network
+mount to time the loads over it, and add --cold (as root, on Linux) to drop
+the page cache of the client before each load."""
+
+import os, shutil, tempfile
+
+from optparse  import OptionParser
+from synthetic import build, best_of
+from daversy.state import FileState
+
+RUNS    = 3
+FORMATS = [('.state', None), ('.state.gz', None), ('.state.gz', 1),
+           ('.state.bz2', None), ('.state.xz', None)]
+
+def drop_caches():
+    os.system('sync')
+    output = open('/proc/sys/vm/drop_caches', 'w')
+    try:
+        output.write('3\n')
+    finally:
+        output.close()
+
+def main():
+    parser = OptionParser(usage='%prog [-n TABLES] [-d DIRECTORY] [--cold]')
+    parser.add_option('-n', dest='tables', type='int', default=5000,
+                      help='the number of tables of the state (default: 5000)')
+    parser.add_option('-d', dest='directory',
+                      help='save the files to DIRECTORY (default: a temporary one)')
+    parser.add_option('--cold', dest='cold', action='store_true',
+                      help='drop the page cache before each load (needs root)')
+    options, args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(dir=options.directory)
+    try:
+        state = build(options.tables)
+        print '%-16s %9s %8s %8s' % ('file', 'size', 'load', 'save')
+        for extension, level in FORMATS:
+            name     = extension
+            location = os.path.join(directory, 'synthetic' + extension)
+            try:
+                save = best_of(1, lambda: FileState().save(state, location, None, level=level))
+            except IOError, e:
+                print '%-16s skipped: %s' % (name, e)
+                continue
+
+            def load():
+                if options.cold:
+                    drop_caches()
+                FileState().load(location, cache=False)
+
+            if level:
+                name += ' -z%d' % level
+            print '%-16s %8.0fK %7.2fs %7.2fs' % (name, os.path.getsize(location) / 1024.0,
+                                                   best_of(RUNS, load), save)
+            os.remove(location)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
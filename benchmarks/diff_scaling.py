@@ -0,0 +1,27 @@
+"""Time the diff of synthetic states of growing size.
+
+Usage: python diff_scaling.py [TABLES...]    (default: 1000 10000 100000)
+
+The target is a copy of the source where 1% of the tables are dropped, 1%
+have a new comment, 1% have a column replaced and 1% more tables are added.
+The diff is computed in process, as by the compare command, and its time is
+reported with the number of changes found and the time per thousand tables,
+which stays about the same as the state grows when the diff is linear."""
+
+import sys
+
+from synthetic import build, mutate, best_of
+from daversy.command.compare import Compare
+
+def main(sizes):
+    print '%8s %8s %9s %13s' % ('tables', 'changes', 'diff', 'per 1k tab')
+    for tables in sizes:
+        source, target = build(tables), mutate(build(tables))
+        compare = Compare()
+        elapsed = best_of(1, compare.diff_states, source, target)
+        print '%8d %8d %8.2fs %12.4fs' % (tables, len(compare.diff),
+                                          elapsed, elapsed * 1000 / tables)
+        del source, target, compare
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or [1000, 10000, 100000])
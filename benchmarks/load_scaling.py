@@ -0,0 +1,35 @@
+"""Time the load of synthetic state files of growing size.
+
+Usage: python load_scaling.py [TABLES...]    (default: 200 5000 20000)
+
+Each state is saved to a temporary file, and loaded a few times without the
+state cache; the best time is reported, with the time per thousand objects,
+which stays about the same as the state grows when the load is linear."""
+
+import os, sys, shutil, tempfile
+
+from synthetic import build, count, best_of
+from daversy.state import FileState
+
+RUNS = 3
+
+def main(sizes):
+    directory = tempfile.mkdtemp()
+    try:
+        print '%8s %9s %10s %9s %13s' % ('tables', 'objects', 'size', 'load', 'per 1k obj')
+        for tables in sizes:
+            state    = build(tables)
+            objects  = count(state)
+            location = os.path.join(directory, '%d.state' % tables)
+            FileState().save(state, location, None)
+            del state
+
+            elapsed = best_of(RUNS, lambda: FileState().load(location, cache=False))
+            print '%8d %9d %9.1fM %8.3fs %12.4fs' % (tables, objects,
+                                                     os.path.getsize(location) / 1048576.0,
+                                                     elapsed, elapsed * 1000 / objects)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or [200, 5000, 20000])
@@ -0,0 +1,179 @@
+"""Synthetic Oracle states for the benchmarks.
+
+A state of N tables holds, along with the tables (5 columns, a primary
+key, and some unique keys and check constraints), N/20 types, N/10
+sequences, N/2 indexes and foreign keys, N/5 views, N/10 procedures,
+functions, packages and triggers, and N/50 materialized views."""
+
+import os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from daversy.db.object import *
+from daversy.db.oracle.adapter import OracleState
+from daversy.db.oracle.code    import OracleObjectType, OraclePackage, OracleMaterializedView
+
+def build(tables, name='synthetic-state'):
+    """Return a synthetic state of the given number of tables."""
+
+    state = OracleState()
+    state.update({'name': name, 'scn': None, 'extracted': None})
+    for i in range(max(1, tables // 20)):
+        type = OracleObjectType()
+        type.name   = 'T_TYPE_%05d' % i
+        type.source = 'TYPE T_TYPE_%05d AS OBJECT (a NUMBER);\n/' % i
+        state.types[type.name] = type
+
+    for i in range(tables):
+        state.tables['TAB_%05d' % i] = build_table('TAB_%05d' % i, i)
+
+    for i in range(tables // 10):
+        sequence = Sequence()
+        sequence.update({'name': 'SEQ_%05d' % i, 'increment-by': '1', 'min-value': '1',
+                         'max-value': '9999999999999999999999999999', 'cache-size': '20',
+                         'cycle-after-last': 'false', 'guaranteed-order': 'false'})
+        state.sequences[sequence.name] = sequence
+
+    for i in range(tables // 2):
+        index = Index()
+        index.update({'name': 'IDX_%05d' % i, 'unique': 'false', 'bitmap': None,
+                      'table-name': 'TAB_%05d' % i, 'compress': None})
+        column = IndexColumn()
+        column.update({'name': 'COL_2', 'sort': 'asc'})
+        index.columns[column.name] = column
+        state.indexes[index.name] = index
+
+    for i in range(1, tables // 2):
+        key = ForeignKey()
+        key.update({'name': 'FK_%05d' % i, 'table': 'TAB_%05d' % i,
+                    'reference-table': 'TAB_%05d' % (i - 1), 'delete-rule': 'no action',
+                    'defer-type': None})
+        column = ForeignKeyColumn()
+        column.update({'name': 'COL_0', 'reference': 'COL_0'})
+        key.columns[column.name] = column
+        state.foreign_keys[key.name] = key
+
+    for i in range(tables // 5):
+        view = View()
+        view.update({'name': 'V_%05d' % i, 'comment': None,
+                     'definition': 'SELECT * FROM TAB_%05d WHERE col_1 < 3' % i})
+        for j in range(2):
+            column = ViewColumn()
+            column.update({'name': 'COL_%d' % j, 'comment': j and 'view col' or None})
+            view.columns[column.name] = column
+        state.views[view.name] = view
+
+    body = '\n'.join(['  x := x + %d; -- line with <xml> & stuff' % k for k in range(40)])
+    for i in range(tables // 10):
+        procedure = StoredProcedure()
+        procedure.update({'name': 'P_%05d' % i, 'invalid': None,
+                          'source': 'PROCEDURE P_%05d IS\n  x NUMBER;\nBEGIN\n%s\nEND;\n/' % (i, body)})
+        state.procedures[procedure.name] = procedure
+
+        function = Function()
+        function.update({'name': 'F_%05d' % i, 'invalid': i % 7 == 0 and 'true' or None,
+                         'source': 'FUNCTION F_%05d RETURN NUMBER IS\nBEGIN\n  RETURN 1;\nEND;\n/' % i})
+        state.functions[function.name] = function
+
+        package = OraclePackage()
+        package.update({'name': 'PKG_%05d' % i, 'invalid': None,
+                        'source': 'PACKAGE PKG_%05d IS\nEND;\n/\nCREATE OR REPLACE PACKAGE BODY '
+                                  'PKG_%05d IS\n%s\nEND;\n/' % (i, i, body * 5)})
+        state.packages[package.name] = package
+
+        trigger = Trigger()
+        trigger.update({'name': 'TRG_%05d' % i, 'object-type': 'table',
+                        'object-name': 'TAB_%05d' % i,
+                        'definition': 'CREATE OR REPLACE TRIGGER TRG_%05d BEFORE INSERT ON '
+                                      'TAB_%05d\nBEGIN\n  NULL;\nEND;\n/' % (i, i)})
+        state.triggers[trigger.name] = trigger
+
+    for i in range(tables // 50):
+        view = OracleMaterializedView()
+        view.update({'name': 'MV_%05d' % i, 'invalid': None, 'refresh-mode': 'demand',
+                     'refresh-method': 'force', 'build-mode': 'immediate',
+                     'query-rewrite': 'disable', 'source': 'SELECT col_0 FROM TAB_%05d' % i})
+        state.mviews[view.name] = view
+
+    return state
+
+def build_table(name, i):
+    table = Table()
+    table.update({'name': name, 'iot': 'false', 'temporary': 'false',
+                  'comment': i % 3 == 0 and 'comment for <table> & "%d"' % i or None,
+                  'on-commit-preserve-rows': None})
+    for j in range(5):
+        column = TableColumn()
+        column.update({'name': 'COL_%d' % j, 'type': j % 2 and 'number' or 'varchar2',
+                       'custom-type': None, 'length': '%d' % (10 + j),
+                       'precision': j % 2 and '10' or None, 'scale': None,
+                       'nullable': j == 0 and 'false' or 'true',
+                       'default-value': j == 3 and "'x'" or None, 'comment': None,
+                       'notnull-defer-type': None, 'check': None, 'check-defer-type': None,
+                       'char-semantics': None, 'virtual': None})
+        table.columns[column.name] = column
+
+    key = PrimaryKey()
+    key.update({'name': 'PK_%05d' % i, 'defer-type': None, 'compress': None})
+    column = PrimaryKeyColumn()
+    column.name = 'COL_0'
+    key.columns[column.name] = column
+    table.primary_keys[key.name] = key
+
+    if i % 4 == 0:
+        key = UniqueKey()
+        key.update({'name': 'UK_%05d' % i, 'defer-type': 'deferred', 'compress': '1'})
+        column = UniqueKeyColumn()
+        column.name = 'COL_1'
+        key.columns[column.name] = column
+        table.unique_keys[key.name] = key
+
+    if i % 5 == 0:
+        check = CheckConstraint()
+        check.update({'name': 'CK_%05d' % i, 'defer-type': None,
+                      'condition': 'COL_1 > 0 AND COL_2 < 5'})
+        table.constraints[check.name] = check
+
+    return table
+
+def mutate(state):
+    """Change the tables of the state: 1% are dropped, 1% have a new comment,
+       1% have a column replaced, and 1% more tables are added."""
+
+    names = state.tables.keys()
+    for i, name in enumerate(names):
+        if i % 100 == 1:
+            del state.tables[name]
+        elif i % 100 == 2:
+            state.tables[name].comment = 'changed'
+        elif i % 100 == 3:
+            del state.tables[name].columns['COL_3']
+            column = TableColumn()
+            column.update(state.tables[name].columns['COL_4'])
+            column.name = 'COL_NEW'
+            state.tables[name].columns[column.name] = column
+
+    for i in range(len(names) // 100):
+        state.tables['NEW_%05d' % i] = build_table('NEW_%05d' % i, i)
+    return state
+
+def count(object):
+    """Return the number of objects in the state (or object), below it."""
+
+    total = 0
+    for key in getattr(object.__class__, 'SubElements', {}).keys():
+        for child in object[key].values():
+            total += 1 + count(child)
+    return total
+
+def best_of(runs, function, *args):
+    """Return the shortest time taken by the function, in seconds."""
+
+    best = None
+    for run in range(runs):
+        start = time.time()
+        function(*args)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
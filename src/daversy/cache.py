@@ -0,0 +1,187 @@
+import os, sys, gc, marshal, hashlib
+from os import path
+from daversy.digest import get_digest, set_digest
+from daversy.utils import atomic_write
+
+CACHE_FORMAT  = 4
+CACHE_DIR     = path.join(path.expanduser('~'), '.daversy', 'cache')
+CACHE_SIZE    = 512 * 1024 * 1024
+CACHE_SUFFIX  = '.dvsc'
+CACHE_INDEX   = 'index'
+
+class StateCache(object):
+    """An on-disk cache of parsed states, keyed by file hash and filters, with LRU eviction."""
+
+    def __init__(self, location=None, size=None):
+        self.location = location or os.environ.get('DAVERSY_CACHE_DIR', CACHE_DIR)
+        self.size     = size or int(os.environ.get('DAVERSY_CACHE_SIZE', 0)) or CACHE_SIZE
+
+    def get(self, location, filters, dbclass):
+        key   = self._key(location, filters)
+        entry = path.join(self.location, key + CACHE_SUFFIX)
+        state = None
+
+        # loading allocates a lot of containers but never any cycles, so
+        # keep the cyclic collector from repeatedly scanning them.
+        collect = gc.isenabled()
+        gc.disable()
+        try:
+            try:
+                stream = file(entry, 'rb')
+                try:
+                    state = decode(dbclass, marshal.load(stream))
+                finally:
+                    stream.close()
+                os.utime(entry, None)
+            except (IOError, OSError, EOFError, ValueError, TypeError):
+                pass
+        finally:
+            if collect:
+                gc.enable()
+
+        self._count(state is None and 'misses' or 'hits')
+        return state
+
+    def put(self, location, filters, state):
+        key = self._key(location, filters)
+        try:
+            self._write(key + CACHE_SUFFIX, marshal.dumps(encode(state)))
+            self._evict()
+        except (IOError, OSError):
+            pass
+
+    def statistics(self):
+        index = self._read_index()
+        entries, size = 0, 0
+        for name, mtime, length in self._entries():
+            entries += 1
+            size    += length
+        return { 'location': self.location, 'entries': entries, 'size': size,
+                 'limit': self.size, 'hits': index['hits'],
+                 'misses': index['misses'] }
+
+    def clear(self):
+        for name, mtime, length in self._entries():
+            try:
+                os.remove(path.join(self.location, name))
+            except OSError:
+                pass
+        index = self._read_index()
+        index['files'], index['hits'], index['misses'] = {}, 0, 0
+        self._write_index(index)
+
+    def _key(self, location, filters):
+        signature = []
+        for section, (include_list, exclude_list) in sorted((filters or {}).items()):
+            signature.append( (section, [f.pattern for f in include_list],
+                                        [f.pattern for f in exclude_list]) )
+
+        key = '%s\n%s\n%s\n%r' % (CACHE_FORMAT, sys.version, self._hash(location),
+                                  signature)
+        return hashlib.sha1(key).hexdigest()
+
+    def _hash(self, location):
+        """Return the content hash of the file, known from its path, size and mtime if unchanged."""
+
+        info   = os.stat(location)
+        stamp  = (info.st_size, info.st_mtime)
+        index  = self._read_index()
+        known  = index['files'].get(path.abspath(location))
+        if known and known[:2] == stamp:
+            return known[2]
+
+        digest = hashlib.sha1()
+        stream = file(location, 'rb')
+        try:
+            for chunk in iter(lambda: stream.read(1024*1024), ''):
+                digest.update(chunk)
+        finally:
+            stream.close()
+
+        # remember the hash, and forget about files that no longer exist
+        index = self._read_index()
+        for name in index['files'].keys():
+            if not path.exists(name):
+                del index['files'][name]
+        index['files'][path.abspath(location)] = stamp + (digest.hexdigest(),)
+        self._write_index(index)
+        return digest.hexdigest()
+
+    def _count(self, counter):
+        index = self._read_index()
+        index[counter] += 1
+        self._write_index(index)
+
+    def _evict(self):
+        entries = self._entries()
+        entries.sort(key=lambda entry: entry[1])
+
+        total = sum([length for name, mtime, length in entries])
+        while entries and total > self.size:
+            name, mtime, length = entries.pop(0)
+            try:
+                os.remove(path.join(self.location, name))
+                total -= length
+            except OSError:
+                pass
+
+    def _entries(self):
+        result = []
+        if not path.isdir(self.location):
+            return result
+        for name in os.listdir(self.location):
+            if name.endswith(CACHE_SUFFIX):
+                try:
+                    info = os.stat(path.join(self.location, name))
+                    result.append( (name, info.st_mtime, info.st_size) )
+                except OSError:
+                    pass
+        return result
+
+    def _read_index(self):
+        try:
+            stream = file(path.join(self.location, CACHE_INDEX), 'rb')
+            try:
+                return marshal.load(stream)
+            finally:
+                stream.close()
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return { 'files': {}, 'hits': 0, 'misses': 0 }
+
+    def _write_index(self, index):
+        try:
+            self._write(CACHE_INDEX, marshal.dumps(index))
+        except (IOError, OSError):
+            pass
+
+    def _write(self, name, data):
+        # concurrent readers never see a partial file
+        if not path.isdir(self.location):
+            os.makedirs(self.location)
+        atomic_write(path.join(self.location, name), data)
+
+#############################################################################
+
+def encode(object):
+    """Convert an object into its properties, its sub-elements and its digest, as plain values."""
+
+    subelements = getattr(object.__class__, 'SubElements', {})
+    properties  = dict([(key, value) for key, value in object.items()
+                                     if key not in subelements])
+    children    = tuple([tuple([(name, encode(child)) for name, child
+                                                      in object[key].items()])
+                         for key in subelements.keys()])
+    return properties, children, get_digest(object)
+
+def decode(dbclass, data):
+    properties, children, digest = data
+    object = dbclass()
+    dict.update(object, properties)
+    if digest is not None:
+        set_digest(object, digest)
+    if children:
+        for (key, childclass), items in zip(object.SubElements.items(), children):
+            collection = object[key]
+            for name, child in items:
+                collection[name] = decode(childclass, child)
+    return object
@@ -39,4 +39,4 @@ class Command(Plugin):
 
         self.execute(args, options)
 
-__all__ = ['copy', 'generate', 'compare', 'name']
+__all__ = ['copy', 'generate', 'compare', 'name', 'cache', 'snapshot', 'batch']
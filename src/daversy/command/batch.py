@@ -0,0 +1,188 @@
+import os, sys, time, ConfigParser
+from optparse import make_option
+from multiprocessing.pool import ThreadPool
+
+from daversy.command    import Command
+from daversy.state      import create_filter, DatabaseState, PROVIDERS
+from daversy.dictionary import Dictionary
+from daversy.utils      import get_uuid4
+
+class Batch(Command):
+    __names__   = ['batch']
+    __usage__   = ['Copy each of the states listed in a MANIFEST, concurrently, '
+                   'and report the time taken and the failures for each of them.',
+                   'The MANIFEST has a section for each state, with its source, '
+                   'its target and optionally a filter (along with the include, '
+                   'exclude, name and comment to use), for instance:',
+                   '[hr] source = oracle:hr/pw@db target = hr.state filter = hr.ini',
+                   'The states of the same source are built from a single read '
+                   'of it, whatever their filters.']
+
+    __args__    = ['MANIFEST']
+    __options__ = [
+        make_option('-w', '--workers', dest='workers', type='int', default=4, metavar='N',
+                    help='copy the states of N sources at a time (default: 4)'),
+        make_option('-j', '--jobs', dest='jobs', type='int', metavar='N',
+                    help='use N concurrent sessions (or threads) to read each state'),
+        make_option('--snapshot', dest='snapshot', action='store_true',
+                    help='read each database as of a single SCN, without recompiling it'),
+        make_option('--arraysize', dest='arraysize', type='int', metavar='N',
+                    help='fetch N rows per round trip from the database (default: 500)'),
+        make_option('--aggregate-source', dest='aggregate', action='store_true',
+                    help='read the PL/SQL source as one value per object instead of one row per line'),
+        make_option('--strict', dest='strict', action='store_true',
+                    help='validate state files against the full XML schema'),
+        make_option('--no-cache', dest='cache', action='store_false', default=True,
+                    help='do not use the cache of previously loaded states'),
+        make_option('-z', dest='level', type='int', metavar='LEVEL',
+                    help='compress a .gz, .bz2 or .xz target at the given LEVEL (1-9)'),
+        make_option('--digest', dest='digest', action='store_true',
+                    help='write the content digest of each object to the target states'),
+        make_option('-o', '--summary', dest='summary', metavar='FILE',
+                    help='also write the summary of the batch to FILE'),
+    ]
+
+    def execute(self, args, options):
+        entries = self.read_manifest(args[0])
+
+        # the entries of the same source are copied one after the other by the
+        # same worker, the sources themselves concurrently
+        sources = []
+        for entry in entries:
+            for source, group in sources:
+                if source == entry['source']:
+                    group.append(entry)
+                    break
+            else:
+                sources.append( (entry['source'], [entry]) )
+
+        print "Copying %d state(s) from %d source(s)" % (len(entries), len(sources))
+
+        start = time.time()
+        pool  = ThreadPool(max(1, min(options.workers, len(sources))))
+        try:
+            groups = pool.map(lambda item: self.copy(item[0], item[1], options), sources, 1)
+        finally:
+            pool.close()
+
+        results = {}
+        for group in groups:
+            results.update(group)
+
+        summary = [SUMMARY_HEADER]
+        for entry in entries:
+            elapsed, objects, error = results[entry['section']]
+            status = error and 'failed' or 'ok'
+            summary.append(SUMMARY_FORMAT % (entry['section'], status, elapsed, objects,
+                                             error or entry['target']))
+
+        failures = len([entry for entry in entries if results[entry['section']][2]])
+        summary.append('%d state(s) copied, %d failed in %.2f seconds.'
+                       % (len(entries) - failures, failures, time.time() - start))
+
+        print '\n'.join(summary)
+        if options.summary:
+            stream = file(options.summary, 'w')
+            try:
+                stream.write('\n'.join(summary) + '\n')
+            finally:
+                stream.close()
+
+        if failures:
+            sys.exit(1)
+
+    def read_manifest(self, location):
+        config = ConfigParser.RawConfigParser()
+        if not config.read(location):
+            self.parser().error('manifest: unable to open for reading')
+
+        entries = []
+        for section in config.sections():
+            entry = dict(config.items(section))
+            entry['section'] = section
+            for key in ('source', 'target'):
+                if not entry.get(key):
+                    self.parser().error('manifest: no %s for %s' % (key, section))
+
+            entry['filters'] = {}
+            if entry.get('filter'):
+                if not os.path.exists(entry['filter']):
+                    self.parser().error('manifest: unable to open the filter of %s' % section)
+                entry['filters'] = create_filter(entry['filter'],
+                                                 entry.get('include', 'all'),
+                                                 entry.get('exclude', 'ignore'))
+            entries.append(entry)
+
+        if not entries:
+            self.parser().error('manifest: no state to copy')
+        return entries
+
+    def copy(self, source, entries, options):
+        """Copy the states of a source, and return the time taken, the number
+           of objects and the error (if any) for each of their sections. A
+           database read for several states is recorded to a dictionary once,
+           and each state built from it."""
+
+        results = {}
+        def failure(entry, error):
+            results[entry['section']] = (entry.get('elapsed', 0.0), 0, error)
+
+        for provider in PROVIDERS:
+            if provider.can_load(source):
+                break
+        else:
+            for entry in entries:
+                failure(entry, 'source: unable to open for reading')
+            return results
+
+        load = dict(strict=options.strict, cache=options.cache, jobs=options.jobs,
+                    snapshot=options.snapshot, arraysize=options.arraysize,
+                    aggregate=options.aggregate, quiet=True)
+
+        if isinstance(provider, DatabaseState) and len(entries) > 1:
+            start, dictionary = time.time(), Dictionary()
+            try:
+                provider.load(source, {}, record=dictionary, **load)
+            except Exception, e:
+                entries[0]['elapsed'] = time.time() - start
+                for entry in entries:
+                    failure(entry, error_message(e))
+                return results
+            load['offline'] = dictionary
+
+            # the read is accounted to the first of the states
+            entries[0]['elapsed'] = time.time() - start
+
+        for entry in entries:
+            start = time.time() - entry.get('elapsed', 0.0)
+            try:
+                state = provider.load(source, entry['filters'], **load)
+                if entry.get('name'):
+                    state.name = entry['name']
+                elif state.setdefault('name') is None:
+                    state.name = get_uuid4()
+
+                for target in PROVIDERS:
+                    if target.can_save(entry['target']):
+                        target.save(state, entry['target'], entry.get('comment', '** dvs **'),
+                                    level=options.level, digest=options.digest)
+                        break
+                else:
+                    raise IOError('target: unable to open for writing')
+            except Exception, e:
+                results[entry['section']] = (time.time() - start, 0, error_message(e))
+                continue
+
+            objects = sum([len(state[key]) for key in state.SubElements.keys()])
+            results[entry['section']] = (time.time() - start, objects, None)
+            print "Copied %s to %s" % (entry['section'], entry['target'])
+
+        return results
+
+def error_message(error):
+    message = str(error).strip().splitlines()
+    return '%s: %s' % (error.__class__.__name__, message and message[0] or '')
+
+SUMMARY_FORMAT = '%-24s %-6s %9.2f %8d  %s'
+SUMMARY_HEADER = '%-24s %-6s %9s %8s  %s' % ('State', 'Status', 'Time(s)', 'Objects',
+                                             'Target / Error')
@@ -0,0 +1,35 @@
+from optparse import make_option
+
+from daversy.command import Command
+from daversy.cache   import StateCache
+
+class Cache(Command):
+    __names__   = ['cache']
+    __usage__   = ['Display the statistics of the cache of loaded states.',
+                   'The cache location and size can be changed with the '
+                   'DAVERSY_CACHE_DIR and DAVERSY_CACHE_SIZE (in bytes) '
+                   'environment variables.']
+
+    __args__    = []
+    __options__ = [
+        make_option('--clear', dest='clear', action='store_true',
+                    help='remove all the entries and reset the statistics'),
+    ]
+
+    def execute(self, args, options):
+        cache = StateCache()
+        if options.clear:
+            cache.clear()
+
+        stats = cache.statistics()
+        total = stats['hits'] + stats['misses']
+        stats['ratio'] = total and 100.0 * stats['hits'] / total or 0.0
+
+        print CACHE_STATISTICS % stats
+
+CACHE_STATISTICS = """\
+location: %(location)s
+entries:  %(entries)d
+size:     %(size)d bytes (limit: %(limit)d bytes)
+hits:     %(hits)d
+misses:   %(misses)d (hit ratio: %(ratio).1f%%)"""
@@ -1,15 +1,19 @@
-import os, sys
+import os, sys, gc, json
 
 from optparse import make_option
 
 from daversy.command import Command
-from daversy.state   import create_filter, PROVIDERS
+from daversy.state   import create_filter, PROVIDERS, FileState, DatabaseState
 from daversy         import difflib_ext
 from daversy.db      import Database
+from daversy.digest  import same_content
 
 class Compare(Command):
     __names__   = ['compare', 'diff']
-    __usage__   = ['Compare the SOURCE state with the TARGET state.']
+    __usage__   = ['Compare the SOURCE state with the TARGET state.',
+                   'With --json, each change is printed as a JSON object on a line '
+                   'of its own, with its op (A, D or M), the path of tags and the '
+                   'names of the changed object, and the changed property (if any).']
 
     __args__    = ['SOURCE', 'TARGET']
     __options__ = [
@@ -19,12 +23,43 @@ class Compare(Command):
                     help='include objects matching specified TAGS from filter (default: "all")'),
         make_option('-x', dest='exclude_tags', default='ignore', metavar='TAGS',
                     help='exclude objects matching specified TAGS from filter (default: "ignore")'),
+        make_option('--strict', dest='strict', action='store_true',
+                    help='validate state files against the full XML schema'),
+        make_option('--no-cache', dest='cache', action='store_false', default=True,
+                    help='do not use the cache of previously loaded states'),
+        make_option('-j', '--jobs', dest='jobs', type='int', metavar='N',
+                    help='use N concurrent sessions (or threads) to read a state'),
+        make_option('--snapshot', dest='snapshot', action='store_true',
+                    help='read the database as of a single SCN, without recompiling it'),
+        make_option('--arraysize', dest='arraysize', type='int', metavar='N',
+                    help='fetch N rows per round trip from the database (default: 500)'),
+        make_option('--aggregate-source', dest='aggregate', action='store_true',
+                    help='read the PL/SQL source as one value per object instead of one row per line'),
+        make_option('--stats', dest='statistics', action='store_true',
+                    help='report the round trips, rows and time of each database query'),
+        make_option('--offline', dest='offline', metavar='FILE',
+                    help='answer the database queries from a dictionary FILE recorded with --record'),
+        make_option('--stream', dest='stream', action='store_true',
+                    help='compare two state files while reading them, holding only the '
+                         'objects not yet matched in memory'),
+        make_option('-q', '--quiet', dest='quiet', action='store_true',
+                    help='print nothing, only exit with 1 if the states differ (0 otherwise), '
+                         'as soon as a difference is found'),
+        make_option('--exit-code', dest='exit_code', action='store_true',
+                    help='exit with 1 if the states differ, 0 otherwise'),
         make_option('--html', dest='html', action='store_true',
                     help='generate a HTML inline difference report'),
+        make_option('--json', dest='json', action='store_true',
+                    help='print each change as a line of JSON'),
         make_option('--context', dest='lines', default=None, type='int',
                     help='number of context lines (default: all lines included).')
     ]
 
+    def __init__(self, cmd=None, argv=None):
+        # without arguments, the command is only used for its changes method
+        if argv is not None:
+            Command.__init__(self, cmd, argv)
+
     def execute(self, args, options):
         filters = {}
         if options.filter:
@@ -33,22 +68,36 @@ class Compare(Command):
             filters = create_filter(options.filter, options.include_tags, options.exclude_tags)
 
         source_location, target_location = args
-        source = target = None
 
-        # load the source state
-        for provider in PROVIDERS:
-            if provider.can_load(source_location):
-                source = provider.load(source_location, filters)
-                break
-        else:
+        if options.html and options.json:
+            self.parser().error('--html and --json are exclusive')
+
+        if options.quiet:
+            sys.exit(self.quick_compare(source_location, target_location, filters,
+                                        options) and 1 or 0)
+
+        if options.stream:
+            if options.html:
+                self.parser().error('--stream only prints the simple diff')
+            for location in args:
+                if not self.is_file(location):
+                    self.parser().error('--stream compares two state files')
+            if self.stream_diff(source_location, target_location, filters, options) \
+                   and options.exit_code:
+                sys.exit(1)
+            return
+
+        load = dict(strict=options.strict, cache=options.cache, jobs=options.jobs,
+                    snapshot=options.snapshot, arraysize=options.arraysize,
+                    aggregate=options.aggregate, statistics=options.statistics,
+                    offline=options.offline)
+
+        source = self.load(source_location, filters, **load)
+        if source is None:
             self.parser().error('source: unable to open for reading')
 
-        # load the target state
-        for provider in PROVIDERS:
-            if provider.can_load(target_location):
-                target = provider.load(target_location, filters)
-                break
-        else:
+        target = self.load(target_location, filters, **load)
+        if target is None:
             self.parser().error('target: unable to open for reading')
 
         if not source.__class__ == target.__class__:
@@ -58,12 +107,288 @@ class Compare(Command):
         target.setdefault('name')
 
         self.source_version, self.target_version = source.name, target.name
-        source.name = target.name = None
-        if source == target:
+
+        self.diff_states(source, target)
+        if not self.diff:
             return
 
+        if options.html:
+            self.print_html_diff(source, target, options.lines)
+        else:
+            self.print_diff(options)
+
+        if self.diff and options.exit_code:
+            sys.exit(1)
+
+    def stream_diff(self, source_location, target_location, filters, options, quiet=False):
+        # the objects are matched by name as they are read, and each section is diffed as soon
+        # as both files are past it; in the same order, only a few objects are held at a time
+        streams = [FileState().read_objects(source_location, filters, strict=options.strict),
+                   FileState().read_objects(target_location, filters, strict=options.strict)]
+        try:
+            source, target = [stream.next() for stream in streams]
+            if source is None or target is None:
+                return False
+
+            if not source.__class__ == target.__class__:
+                self.parser().error('source and target represent different databases')
+
+            differ = False
+            for diff in self.stream_changes(streams, source,
+                                            (source_location, target_location), quiet):
+                if quiet:
+                    return True
+                differ, self.diff = True, diff
+                self.print_diff(options)
+            return differ
+        finally:
+            for stream in streams:
+                stream.close()
+
+    def stream_changes(self, streams, source, locations, quiet=False):
+        # when quiet, the diff of the first object that differs is yielded as soon as it is read
+        self.setup(source)
+
+        keys      = source.SubElements.keys()
+        sections  = [StreamSection() for key in keys]
+        position  = [0, 0]
+
+        def read(side):
+            try:
+                key, object = streams[side].next()
+            except StopIteration:
+                position[side] = len(keys)
+                return False
+
+            if keys.index(key) < position[side]:
+                raise LookupError('The objects of %s are not grouped by type'
+                                  % locations[side])
+            position[side] = keys.index(key)
+
+            section = sections[position[side]]
+            pending = section.pending[1 - side]
+            section.count[side] += 1
+            if not pending.has_key(object.name):
+                section.pending[side][object.name] = (section.count[side], object)
+                return False
+
+            index, other = pending.pop(object.name)
+            if side == 0:
+                index, src, tgt = section.count[0], object, other
+            else:
+                src, tgt = other, object
+
+            self.diff = []
+            self.compute_diff((None, (src, tgt, object.name)), src, tgt)
+            if self.diff:
+                section.changes.append( (index, self.diff) )
+            return bool(self.diff)
+
+        # the file that is behind reads on, or both in turn while they are
+        # in the same section
+        side, flushed = 0, 0
+        while min(position) < len(keys):
+            if position[0] != position[1]:
+                side = position[0] > position[1] and 1 or 0
+            else:
+                side = 1 - side
+            if read(side) and quiet:
+                yield self.diff
+                return
+
+            while flushed < min(position):
+                diff = self.section_diff(sections[flushed])
+                sections[flushed] = None
+                flushed += 1
+                if diff:
+                    yield diff
+
+    def section_diff(self, section):
+        """Return the deleted, added and changed objects of a section, in file order."""
+
+        order = lambda item: item[1][0]
+
+        diff = []
+        for name, (index, object) in sorted(section.pending[0].items(), key=order):
+            diff.append( ('D', [(object, None, name)]) )
+        for name, (index, object) in sorted(section.pending[1].items(), key=order):
+            diff.append( ('A', [(None, object, name)]) )
+        for index, changes in sorted(section.changes, key=lambda change: change[0]):
+            diff.extend(changes)
+        return diff
+
+    def changes(self, source_location, target_location, filters={}, **options):
+        """Yield the changes from the source state to the target state, as the --json records."""
+
+        locations = (source_location, target_location)
+        if self.is_file(source_location) and self.is_file(target_location):
+            streams = [FileState().read_objects(location, filters, strict=options.get('strict'))
+                       for location in locations]
+            try:
+                source, target = [stream.next() for stream in streams]
+                if source is None or target is None:
+                    return
+                if not source.__class__ == target.__class__:
+                    raise LookupError('source and target represent different databases')
+                for diff in self.stream_changes(streams, source, locations):
+                    for record in self.records(diff):
+                        yield record
+            finally:
+                for stream in streams:
+                    stream.close()
+            return
+
+        states = []
+        for location in locations:
+            states.append(self.load(location, filters, **options))
+            if states[-1] is None:
+                raise IOError('%s: unable to open for reading' % location)
+
+        source, target = states
+        if not source.__class__ == target.__class__:
+            raise LookupError('source and target represent different databases')
+
+        self.diff_states(source, target)
+        for record in self.records(self.diff):
+            yield record
+
+    def load(self, location, filters, **options):
+        """Return the state at the location with the digests of its objects, or None."""
+
+        for provider in PROVIDERS:
+            if provider.can_load(location):
+                return provider.load(location, filters, digests=True, **options)
+        return None
+
+    def diff_states(self, source, target):
+        """Compute the diff between two states, without the properties of the states themselves."""
+
+        self.setup(source)
+
+        # the properties of a state (its name, the snapshot and time it was
+        # read at) describe where it comes from, they are not its content
+        for builder in self.db.__builders__:
+            if builder.DbClass == self.db.__state__:
+                for prop in builder.PropertyList.values():
+                    source[prop.name] = target[prop.name] = None
+
+        self.diff = []
+
+        # the states hold no cycles, so keep the cyclic collector from
+        # repeatedly scanning them while the diff is computed
+        collect = gc.isenabled()
+        gc.disable()
+        try:
+            self.compute_diff(None, source, target)
+        finally:
+            if collect:
+                gc.enable()
+
+    def quick_compare(self, source_location, target_location, filters, options):
+        # state files are the same file, or compared by the digest they were saved with, or
+        # while they are read; a database state is loaded last, and only until a section differs
+        locations = (source_location, target_location)
+        if self.is_file(source_location) and self.is_file(target_location):
+            if os.path.samefile(source_location, target_location):
+                return False
+            if not filters:
+                digests = [FileState().read_digest(location) for location in locations]
+                if None not in digests:
+                    return digests[0] != digests[1]
+            return self.stream_diff(source_location, target_location, filters, options,
+                                    quiet=True)
+
+        providers = []
+        for location in locations:
+            for provider in PROVIDERS:
+                if provider.can_load(location):
+                    providers.append(provider)
+                    break
+            else:
+                self.parser().error('%s: unable to open for reading' % location)
+
+        # the states that are not read from a database come first, so that
+        # a database can be compared section by section while it is read
+        sides = [0, 1]
+        if isinstance(providers[0], DatabaseState) and not isinstance(providers[1], DatabaseState):
+            sides.reverse()
+
+        states, checked, self.differ = [None, None], [], False
+        for side in sides:
+            until = None
+            if states[1 - side] is not None:
+                until = self.section_check(states, side, checked)
+            states[side] = providers[side].load(locations[side], filters,
+                                                strict=options.strict,
+                                                cache=options.cache, jobs=options.jobs,
+                                                snapshot=options.snapshot,
+                                                arraysize=options.arraysize,
+                                                aggregate=options.aggregate,
+                                                offline=options.offline,
+                                                digests=True, quiet=True, until=until)
+            if self.differ:
+                return True
+
+        source, target = states
+        if not source.__class__ == target.__class__:
+            self.parser().error('source and target represent different databases')
+
+        self.setup(source)
+        for key in source.SubElements.keys():
+            if key not in checked and self.section_differs(source[key], target[key]):
+                return True
+        return False
+
+    def section_check(self, states, side, checked):
+        """Return a function that tells to stop reading once a complete section differs."""
+
+        other = states[1 - side]
+        self.setup(other)
+
+        # a section is complete once the builders of all its objects ran
+        complete = {}
+        for key, dbclass in other.SubElements.items():
+            classes, pending = [], [dbclass]
+            while pending:
+                classes.append(pending.pop())
+                pending.extend(getattr(classes[-1], 'SubElements', {}).values())
+            last = [builder for builder in self.db.__builders__ if builder.DbClass in classes]
+            if last:
+                complete.setdefault(last[-1], []).append(key)
+
+        def until(state, builder):
+            for key in complete.get(builder, []):
+                checked.append(key)
+                sections = [None, None]
+                sections[side], sections[1 - side] = state[key], other[key]
+                if self.section_differs(*sections):
+                    self.differ = True
+                    return True
+            return False
+
+        return until
+
+    def section_differs(self, source, target):
+        """Return whether two collections of top-level objects differ."""
+
+        if len(source) != len(target):
+            return True
+
+        for name, elem in source.items():
+            if not target.has_key(name):
+                return True
+            if not same_content(elem, target[name]):
+                self.diff = []
+                self.compute_diff((None, (elem, target[name], name)), elem, target[name])
+                if self.diff:
+                    return True
+        return False
+
+    def setup(self, state):
+        """Look up the database of the state, with the builders and tags of its objects."""
+
         for db in Database.list():
-            if db.__state__ == source.__class__:
+            if db.__state__ == state.__class__:
                 self.db = db
 
         self.builders = {}
@@ -72,62 +397,68 @@ class Compare(Command):
             self.builders[builder.DbClass] = builder
             self.tags[builder.DbClass] = builder.XmlTag
 
-        self.diff = []
-        self.compute_diff([], source, target)
-        if not options.html:
-            self.print_simple_diff()
-        else:
-            self.print_html_diff(source, target, options.lines)
+    def is_file(self, location):
+        """Return whether the state is read from a state file."""
+        for provider in PROVIDERS:
+            if provider.can_load(location):
+                return provider.__class__ == FileState
+        return False
 
     def compute_diff(self, location, source, target):
+        # the location is a (parent location, entry) pair, turned into a list only for a difference
         builder = self.builders[source.__class__]
 
-        if source == target:
+        # objects with the same digest are identical, as are their sub-elements
+        if same_content(source, target):
             return
 
         if hasattr(source, 'SubElements'):
             for key in source.SubElements.keys():
                 src, tgt = source[key], target[key]
-                if not src == tgt:
-                    src_names = [elem.name for elem in src.values()]
-                    tgt_names = [elem.name for elem in tgt.values()]
-                    common    = []
-                    for elem in src.values():
-                        if not elem.name in tgt_names:
-                            path = location[:]
-                            path.append( (elem, None, elem.name) )
-                            self.diff.append( ('D', path) )
-                        elif common.count(elem.name) == 0:
-                            common.append(elem.name)
-                    for elem in tgt.values():
-                        if not elem.name in src_names:
-                            path = location[:]
-                            path.append( (None, elem, elem.name) )
-                            self.diff.append( ('A', path) )
-                        elif common.count(elem.name) == 0:
-                            common.append(elem.name)
-                    for name in common:
-                        path = location[:]
-                        path.append( (src[name], tgt[name], name) )
-                        self.compute_diff(path, src[name], tgt[name])
+                for name, elem in src.items():
+                    if not tgt.has_key(name):
+                        self.diff.append( ('D', get_path(location, (elem, None, name))) )
+                for name, elem in tgt.items():
+                    if not src.has_key(name):
+                        self.diff.append( ('A', get_path(location, (None, elem, name))) )
+                for name, elem in src.items():
+                    if tgt.has_key(name):
+                        self.compute_diff((location, (elem, tgt[name], name)),
+                                          elem, tgt[name])
 
         if hasattr(builder, 'PropertyList'):
             for prop in builder.PropertyList.values():
                 if not prop.exclude:
                     if source[prop.name] != target[prop.name]:
-                        path = location[:]
-                        path.append( (None, None, prop.name) )
-                        self.diff.append( ('M', path) )
+                        self.diff.append( ('M', get_path(location, (None, None, prop.name))) )
 
-    def print_simple_diff(self):
-        for op, path in self.diff:
-            sys.stdout.write('%s' % op)
+    def records(self, diff):
+        """Yield the changes of a diff as records (see changes)."""
+
+        for op, path in diff:
+            record = { 'op': op, 'path': [], 'names': [], 'property': None }
             for src, target, name in path:
                 if src is None and target is None:
-                    sys.stdout.write(' @%s' % name)
+                    record['property'] = name
                 else:
-                    elem = src or target
-                    sys.stdout.write(' %s[%s]' % (self.tags[elem.__class__], name))
+                    record['path'].append(self.tags[(src or target).__class__])
+                    record['names'].append(name)
+            yield record
+
+    def print_diff(self, options):
+        if options.json:
+            self.print_json_diff()
+        else:
+            self.print_simple_diff()
+
+    def print_simple_diff(self):
+        for record in self.records(self.diff):
+            sys.stdout.write(format_change(record))
+            sys.stdout.write('\n')
+
+    def print_json_diff(self):
+        for record in self.records(self.diff):
+            sys.stdout.write(json.dumps(record, sort_keys=True))
             sys.stdout.write('\n')
 
     def print_html_diff(self, source, target, context):
@@ -177,3 +508,31 @@ class Compare(Command):
         if hasattr(builder, 'commentSQL'):
             sql.extend( builder.commentSQL(elem) )
         return sql
+
+def format_change(record):
+    """Return a change record as a line of the simple diff."""
+
+    line = [record['op']]
+    for tag, name in zip(record['path'], record['names']):
+        line.append('%s[%s]' % (tag, name))
+    if record['property'] is not None:
+        line.append('@%s' % record['property'])
+    return ' '.join(line)
+
+def get_path(location, entry):
+    """Return the list of entries from the root down to the given entry."""
+
+    path = [entry]
+    while location is not None:
+        location, entry = location
+        path.append(entry)
+    path.reverse()
+    return path
+
+class StreamSection(object):
+    """The unmatched objects of a section of each file, and the changes of the matched ones."""
+
+    def __init__(self):
+        self.pending = [{}, {}]
+        self.count   = [0, 0]
+        self.changes = []
@@ -17,10 +17,37 @@ class Copy(Command):
                     help='include objects matching specified TAGS from filter (default: "all")'),
         make_option('-x', dest='exclude_tags', default='ignore', metavar='TAGS',
                     help='exclude objects matching specified TAGS from filter (default: "ignore")'),
+        make_option('--strict', dest='strict', action='store_true',
+                    help='validate state files against the full XML schema'),
+        make_option('--no-cache', dest='cache', action='store_false', default=True,
+                    help='do not use the cache of previously loaded states'),
+        make_option('-j', '--jobs', dest='jobs', type='int', metavar='N',
+                    help='use N concurrent sessions (or threads) to read a state'),
+        make_option('--snapshot', dest='snapshot', action='store_true',
+                    help='read the database as of a single SCN, without recompiling it'),
+        make_option('--arraysize', dest='arraysize', type='int', metavar='N',
+                    help='fetch N rows per round trip from the database (default: 500)'),
+        make_option('--aggregate-source', dest='aggregate', action='store_true',
+                    help='read the PL/SQL source as one value per object instead of one row per line'),
+        make_option('--stats', dest='statistics', action='store_true',
+                    help='report the round trips, rows and time of each database query'),
+        make_option('--offline', dest='offline', metavar='FILE',
+                    help='answer the database queries from a dictionary FILE recorded with --record'),
+        make_option('--record', dest='record', metavar='FILE',
+                    help='record the rows read from the database to a dictionary FILE'),
+        make_option('-b', '--base', dest='base', metavar='STATE',
+                    help='only read the objects altered since the BASE state was read from the database'),
+        make_option('--incremental', dest='incremental', action='store_true',
+                    help='record when the database was read, so that the TARGET can be used as '
+                         'a BASE later (implied by --base)'),
         make_option('-n', dest='name',
                     help='rename the target state to specified NAME.'),
         make_option('-c', dest='comment', default='** dvs **',
                     help='use the given check-in comment (if applicable)'),
+        make_option('-z', dest='level', type='int', metavar='LEVEL',
+                    help='compress a .gz, .bz2 or .xz TARGET at the given LEVEL (1-9)'),
+        make_option('--digest', dest='digest', action='store_true',
+                    help='write the content digest of each object to the TARGET state'),
     ]
 
     def execute(self, args, options):
@@ -31,11 +58,33 @@ class Copy(Command):
             filters = create_filter(options.filter, options.include_tags, options.exclude_tags)
 
         input, output = args
+        # load the base state, that unaltered objects are carried over from
+        base = None
+        if options.base:
+            for provider in PROVIDERS:
+                if provider.can_load(options.base):
+                    base = provider.load(options.base, filters, strict=options.strict,
+                                         cache=options.cache)
+                    break
+            else:
+                self.parser().error('base: unable to open for reading')
+            if not base.get('extracted'):
+                self.parser().error('base: the state does not record when it was read '
+                                    '(copy it with --incremental)')
+
         # load the source state
         saved_state = None
         for provider in PROVIDERS:
             if provider.can_load(input):
-                saved_state = provider.load(input, filters)
+                saved_state = provider.load(input, filters, strict=options.strict,
+                                            cache=options.cache, jobs=options.jobs,
+                                            snapshot=options.snapshot,
+                                            arraysize=options.arraysize,
+                                            aggregate=options.aggregate,
+                                            statistics=options.statistics,
+                                            offline=options.offline,
+                                            record=options.record,
+                                            base=base, incremental=options.incremental)
                 break
         else:
             self.parser().error('source: unable to open for reading')
@@ -49,7 +98,8 @@ class Copy(Command):
         # save it to target state
         for provider in PROVIDERS:
             if provider.can_save(output):
-                provider.save(saved_state, output, options.comment)
+                provider.save(saved_state, output, options.comment,
+                              level=options.level, digest=options.digest)
                 break
         else:
             self.parser().error('target: unable to open for writing')
@@ -16,6 +16,22 @@ class Generate(Command):
                     help='include objects matching specified TAGS from filter (default: "all")'),
         make_option('-x', dest='exclude_tags', default='ignore', metavar='TAGS',
                     help='exclude objects matching specified TAGS from filter (default: "ignore")'),
+        make_option('--strict', dest='strict', action='store_true',
+                    help='validate state files against the full XML schema'),
+        make_option('--no-cache', dest='cache', action='store_false', default=True,
+                    help='do not use the cache of previously loaded states'),
+        make_option('-j', '--jobs', dest='jobs', type='int', metavar='N',
+                    help='use N concurrent sessions (or threads) to read a state'),
+        make_option('--snapshot', dest='snapshot', action='store_true',
+                    help='read the database as of a single SCN, without recompiling it'),
+        make_option('--arraysize', dest='arraysize', type='int', metavar='N',
+                    help='fetch N rows per round trip from the database (default: 500)'),
+        make_option('--aggregate-source', dest='aggregate', action='store_true',
+                    help='read the PL/SQL source as one value per object instead of one row per line'),
+        make_option('--stats', dest='statistics', action='store_true',
+                    help='report the round trips, rows and time of each database query'),
+        make_option('--offline', dest='offline', metavar='FILE',
+                    help='answer the database queries from a dictionary FILE recorded with --record'),
         make_option('-s', dest='type', choices=('create', 'comment', 'all'),
                     help='generate SQL of the specified type'),
         make_option('-c', dest='comment', default='** dvs **',
@@ -34,7 +50,13 @@ class Generate(Command):
         saved_state = None
         for provider in PROVIDERS:
             if provider.can_load(input):
-                saved_state = provider.load(input, filters)
+                saved_state = provider.load(input, filters, strict=options.strict,
+                                            cache=options.cache, jobs=options.jobs,
+                                            snapshot=options.snapshot,
+                                            arraysize=options.arraysize,
+                                            aggregate=options.aggregate,
+                                            statistics=options.statistics,
+                                            offline=options.offline)
                 break
         else:
             self.parser().error('state: unable to open for reading')
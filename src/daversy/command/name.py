@@ -10,13 +10,15 @@ class Name(Command):
 
     def execute(self, args, options):
         input = args[0]
-        saved_state = None
         for provider in PROVIDERS:
             if provider.can_load(input):
-                saved_state = provider.load(input, {})
+                # only read the header of the state, if possible
+                if hasattr(provider, 'read_name'):
+                    name = provider.read_name(input)
+                else:
+                    name = provider.load(input, {}).name
                 break
-
-        if not saved_state:
+        else:
             self.parser().error('STATE: could not open for reading')
 
-        print saved_state.name
+        print name
@@ -0,0 +1,38 @@
+from optparse import make_option
+
+from daversy.command import Command
+from daversy.state   import DatabaseState
+
+class Snapshot(Command):
+    __names__   = ['snapshot']
+    __usage__   = ['Record the rows of every query that reads the SOURCE database '
+                   'to a TARGET dictionary file.',
+                   'A state can then be built from the TARGET, with any filter, '
+                   'without reading the database again. A .dvsraw TARGET is a '
+                   'compact file, anything else a SQLite database.']
+
+    __args__    = ['SOURCE', 'TARGET']
+    __options__ = [
+        make_option('-j', '--jobs', dest='jobs', type='int', metavar='N',
+                    help='use N concurrent sessions to read the database'),
+        make_option('--snapshot', dest='snapshot', action='store_true',
+                    help='read the database as of a single SCN, without recompiling it'),
+        make_option('--arraysize', dest='arraysize', type='int', metavar='N',
+                    help='fetch N rows per round trip from the database (default: 500)'),
+        make_option('--aggregate-source', dest='aggregate', action='store_true',
+                    help='read the PL/SQL source as one value per object instead of one row per line'),
+        make_option('--stats', dest='statistics', action='store_true',
+                    help='report the round trips, rows and time of each database query'),
+    ]
+
+    def execute(self, args, options):
+        source, target = args
+
+        provider = DatabaseState()
+        if not provider.can_load(source):
+            self.parser().error('source: unable to open for reading')
+
+        # without any filter, so that the dictionary holds all the rows
+        provider.load(source, {}, record=target, jobs=options.jobs,
+                      snapshot=options.snapshot, arraysize=options.arraysize,
+                      aggregate=options.aggregate, statistics=options.statistics)
@@ -43,7 +43,9 @@ class OracleStateBuilder(OracleBuilder):
     XmlTag  = 'dvs-state'
 
     PropertyList = odict(
-        ('NAME',  Property('name'))
+        ('NAME',      Property('name')),
+        ('SCN',       Property('scn')),
+        ('EXTRACTED', Property('extracted'))
     )
 
 class OracleDatabase(Database):
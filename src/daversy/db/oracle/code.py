@@ -1,39 +1,119 @@
+import re, itertools
 from daversy.utils import *
 from daversy.db.object import DbObject, Function, StoredProcedure
+from connection import cx_Oracle, filter_condition, changed_condition, as_of_scn
+
+# the escaped characters of an aggregated source
+SOURCE_CHAR   = re.compile(r'&#(x[0-9a-fA-F]+|[0-9]+);')
+SOURCE_PREFIX = '/\nCREATE OR REPLACE '
 
 class CodeBuilder(object):
-    @staticmethod
-    def customQuery(cursor, state, builder):
-        cursor.execute("""
-            SELECT name, text, DECODE(line, 1, '/'||chr(10)||'CREATE OR REPLACE ', '') AS prefix
+    SourceQuery = """
+            SELECT name, type, text
+            FROM   user_source
+            WHERE  type IN ('%s')%s
+            ORDER BY name, type, line"""
+
+    # With --aggregate-source, the source is aggregated on the server, into a
+    # single CLOB per object and type holding each line in an element of its
+    # own, and split back into its lines here. The XML round trip may not keep
+    # every character as it is, so this is not the default, and the lines are
+    # read one per row if the aggregation fails.
+    AggregateQuery = """
+            SELECT name, type,
+                   XMLSERIALIZE(CONTENT XMLAGG(XMLELEMENT("l", text) ORDER BY line) AS CLOB) AS source
             FROM   user_source
-            WHERE  type IN ('%s')
-            ORDER BY name, type, line""" % "', '".join(builder.DbType))
-
-        name = None
-        text = []
-        sep  = '\n'
-        norm = lambda x: (x[2] or '')+x[1].rstrip().lstrip('\n')
-        wrap = lambda x: (x[2] and '\n'+x[2] or '')+x[1]
-        for row in cursor:
-            if name != row[0]:
-                if name is not None:
-                    obj = builder.getObject(state, name)
-                    if obj: obj.source = sep.join(text).lstrip('\n\t/ ')+'\n/'
-                name = row[0]
-                text = []
-                line = norm
-                if ' wrapped\n' in row[1]:
-                    # it's wrapped, so use a different method for joining
-                    sep, line = '', wrap
-            text.append(line(row))
-
-        if text:
-            obj = builder.getObject(state, name)
-            if obj: obj.source = sep.join(text).lstrip('\n\t/ ')+'\n/'
+            WHERE  type IN ('%s')%s
+            GROUP BY name, type
+            ORDER BY name, type"""
 
+    # the properties that the custom query reads (see DatabaseState._carry_over)
+    CustomProperties = ['source']
+
+    @staticmethod
+    def customQuery(cursor, state, builder, filters=None, since=None, aggregate=False):
+        condition, binds = filter_condition('name', filters, 'f')
+        conditions = condition and [condition] or []
+        if since:
+            # only the source of the objects altered since then
+            conditions.append(changed_condition('name', builder.DbType))
+            binds['since'] = since
+
+        arguments = ("', '".join(builder.DbType), ''.join([' AND ' + c for c in conditions]))
+        pinned = lambda query: query
+        if state.get('scn'):
+            # read as of the same SCN as the queries of the other builders
+            pinned = as_of_scn
+            binds['scn'] = long(state.scn)
+        if aggregate:
+            try:
+                cursor.execute(pinned(builder.AggregateQuery % arguments), binds)
+                set_sources(state, builder, source_lines(cursor))
+                cursor.close()
+                return
+            except (cx_Oracle.DatabaseError, LookupError):
+                pass
+
+        cursor.execute(pinned(builder.SourceQuery % arguments), binds)
+        set_sources(state, builder, grouped_lines(cursor))
         cursor.close()
 
+def set_sources(state, builder, sources):
+    """Set the source of each object from the lines of each of its types."""
+
+    name = None
+    text = []
+    sep  = '\n'
+    norm = lambda lines: [SOURCE_PREFIX + lines[0].rstrip().lstrip('\n')] + \
+                         [x.rstrip().lstrip('\n') for x in lines[1:]]
+    wrap = lambda lines: ['\n' + SOURCE_PREFIX + lines[0]] + lines[1:]
+    for row in sources:
+        if name != row[0]:
+            if name is not None:
+                obj = builder.getObject(state, name)
+                if obj: obj.source = sep.join(text).lstrip('\n\t/ ')+'\n/'
+            name = row[0]
+            text = []
+            line = norm
+            if ' wrapped\n' in row[1][0]:
+                # it's wrapped, so use a different method for joining
+                sep, line = '', wrap
+        text.extend(line(row[1]))
+
+    if text:
+        obj = builder.getObject(state, name)
+        if obj: obj.source = sep.join(text).lstrip('\n\t/ ')+'\n/'
+
+def grouped_lines(cursor):
+    """Return the name and the lines of the source of each object and type,
+       from the rows of user_source."""
+
+    for (name, type), rows in itertools.groupby(cursor, lambda row: row[:2]):
+        yield name, [row[2] for row in rows]
+
+def source_lines(cursor):
+    """Return the name and the lines of the source of each object and type,
+       as they are in user_source."""
+
+    for name, type, source in cursor:
+        # each line is in an <l> element, which is <l/> when it is empty
+        lines = source.replace('<l/>', '<l></l>')[len('<l>'):-len('</l>')]
+        yield name, [unescape(text) for text in lines.split('</l><l>')]
+
+def unescape(text):
+    if '&' not in text:
+        return text
+
+    def character(match):
+        code = match.group(1)
+        char = unichr(code[0] == 'x' and int(code[1:], 16) or int(code))
+        return isinstance(text, str) and char.encode('utf-8') or char
+
+    if '&#' in text:
+        text = SOURCE_CHAR.sub(character, text)
+    return text.replace('&lt;', '<').replace('&gt;', '>').replace('&quot;', '"') \
+               .replace('&apos;', "'").replace('&amp;', '&')
+
 class StoredProcedureBuilder(CodeBuilder):
     """Represents a builder for a stored procedure."""
 
@@ -190,6 +270,7 @@ class OracleMaterializedViewBuilder(object):
 
     DbClass = OracleMaterializedView
     XmlTag  = 'materialized-view'
+    DbType  = ['MATERIALIZED VIEW']
 
     Query = """
         SELECT mview_name,
@@ -12,6 +12,7 @@ class TableColumnBuilder(object):
 
     DbClass = TableColumn
     XmlTag  = 'column'
+    Parents = [('PARENT_NAME', 'table')]
 
     PropertyList = odict(
         ('COLUMN_NAME',     Property('name')),
@@ -119,6 +120,7 @@ class ViewColumnBuilder(object):
 
     DbClass = ViewColumn
     XmlTag  = 'column'
+    Parents = [('PARENT_NAME', 'view')]
 
     PropertyList = odict(
         ('COLUMN_NAME',     Property('name')),
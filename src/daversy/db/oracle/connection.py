@@ -1,17 +1,74 @@
-DEFAULT_NLS_LANG = 'AMERICAN_AMERICA.AL32UTF8'
+DEFAULT_NLS_LANG  = 'AMERICAN_AMERICA.AL32UTF8'
+DEFAULT_ARRAYSIZE = 500
+TIMESTAMP_FORMAT  = 'YYYY-MM-DD"T"HH24:MI:SS'
 
-import os
+import os, re
 os.environ['NLS_LANG'] = DEFAULT_NLS_LANG
 import cx_Oracle
 
+# name patterns that mean the same to Python and to Oracle regular expressions
+PORTABLE_PATTERN = re.compile(r'^\^[A-Za-z0-9_$#.*+?()\[\]{},^-]*\$$')
+
+# the parts of a query that matter to where its conditions go
+QUERY_TOKEN   = re.compile(r"'[^']*'|\"[^\"]*\"|[(),]|\b(?:SELECT|FROM|WHERE|OR|GROUP\s+BY|ORDER\s+BY)\b", re.I)
+SELECT_COLUMN = re.compile(r'^((?:\w+\.)?(\w+))(?:\s+(?:AS\s+)?"?(\w+)"?)?$', re.I)
+
+# the dictionary views that a query reads
+DICTIONARY_VIEW = re.compile(r'\b((?:sys\.)?user_\w+)\b', re.I)
+
 class OracleConnection(object):
-    def __init__(self, info):
+    def __init__(self, info, snapshot=False, scn=None, arraysize=None, worker=False):
         self.connection = cx_Oracle.connect(info[0])
-        self.setup_dbms_metadata()
+        self.connection.outputtypehandler = self.output_type
+        self.arraysize  = arraysize or DEFAULT_ARRAYSIZE
+        self.scn        = None
+        self.started    = self.timestamp()
+        if snapshot:
+            self.setup_snapshot(scn)
+        elif worker:
+            self.setup_transform()
+        else:
+            self.setup_dbms_metadata()
         
     def cursor(self):
-        return self.connection.cursor()
+        """Return a cursor that fetches (and prefetches) many rows per round
+           trip."""
+        cursor = self.connection.cursor()
+        cursor.arraysize = self.arraysize
+        if hasattr(cursor, 'prefetchrows'):
+            cursor.prefetchrows = self.arraysize + 1
+        return cursor
+
+    @staticmethod
+    def output_type(cursor, name, type, size, precision, scale):
+        # fetch LOBs inline with the rows, instead of a round trip per value
+        if type in (cx_Oracle.CLOB, cx_Oracle.NCLOB):
+            return cursor.var(cx_Oracle.LONG_STRING, arraysize=cursor.arraysize)
+        if type == cx_Oracle.BLOB:
+            return cursor.var(cx_Oracle.LONG_BINARY, arraysize=cursor.arraysize)
         
+    def timestamp(self):
+        """Return the current time of the database, in the format of the
+           DDL times that are compared with it."""
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT TO_CHAR(SYSDATE, '%s') FROM dual" % TIMESTAMP_FORMAT)
+        result = cursor.fetchone()[0]
+        cursor.close()
+        return result
+
+    def changed_objects(self, since):
+        """Return the (type, name) of the objects that were created or
+           altered at or after the given time."""
+        cursor = self.cursor()
+        cursor.execute("""
+            SELECT object_type, object_name
+            FROM   sys.user_objects
+            WHERE  last_ddl_time >= TO_DATE(:since, '%s')""" % TIMESTAMP_FORMAT,
+            since=since)
+        result = cursor.fetchall()
+        cursor.close()
+        return result
+
     def setup_dbms_metadata(self):
         cursor = self.connection.cursor()
         cursor.execute("""
@@ -27,5 +84,179 @@ class OracleConnection(object):
             END;""")
         cursor.close()
 
+    def setup_transform(self):
+        """Only set the session transform of dbms_metadata: the session of
+           a worker reads the schema that the main session prepared, and
+           recompiling it again would invalidate objects as they are read."""
+
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            BEGIN
+                dbms_metadata.set_transform_param(dbms_metadata.session_transform,'SQLTERMINATOR', true);
+            END;""")
+        cursor.close()
+
+    def setup_snapshot(self, scn=None):
+        """Keep the given SCN, or the current one, for the queries of the
+           builders to read the dictionary as of it (see snapshot_query).
+           Nothing is compiled, the schema is left exactly as it is.
+
+           The session itself is not put in flashback mode, where dbms_metadata
+           and temporary LOBs may fail (ORA-08182): the DDL that dbms_metadata
+           returns, that of the triggers, is thus read as it is now."""
+
+        self.setup_transform()
+        if scn is None:
+            cursor = self.connection.cursor()
+            cursor.execute("SELECT dbms_flashback.get_system_change_number FROM dual")
+            scn = cursor.fetchone()[0]
+            cursor.close()
+        self.scn = scn
+
+    def restrict(self, query, columns, changes=(), since=None):
+        """Return the query, restricted to the rows whose columns may pass
+           the given filters, along with its bind variables.
+
+           If a time is given, the rows are also restricted to those where
+           one of the changes columns names an object of the given types
+           that was altered since then."""
+
+        # the conditions go in the query itself, on the columns it selects,
+        # so that its ORDER BY still applies to the rows
+        expressions = select_columns(query)
+        conditions, binds = [], {}
+        for index, (column, filters) in enumerate(columns):
+            if column not in expressions:
+                continue
+            condition, variables = filter_condition(expressions[column], filters, 'f%d' % index)
+            if condition:
+                conditions.append(condition)
+                binds.update(variables)
+
+        if since and changes and not [column for column, types in changes
+                                      if column not in expressions]:
+            conditions.append('(%s)' % ' OR '.join([changed_condition(expressions[column], types)
+                                                    for column, types in changes]))
+            binds['since'] = since
+
+        restricted = conditions and add_conditions(query, conditions)
+        if not restricted:
+            return query, {}
+        return restricted, binds
+
+    def snapshot_query(self, query, binds):
+        """Return the query and its bind variables, reading the dictionary as
+           of the SCN of the snapshot, if any."""
+        if self.scn is None:
+            return query, binds
+        return as_of_scn(query), dict(binds, scn=self.scn)
+
     def close(self):
         self.connection.close()
+
+def query_clauses(query):
+    """Return the keywords of the clauses of the main query, outside of any
+       parentheses, with their positions; and the positions of its commas."""
+
+    depth, clauses, commas = 0, [], []
+    for match in QUERY_TOKEN.finditer(query):
+        token = match.group(0)
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        elif depth > 0 or token[0] in '\'"':
+            continue
+        elif token == ',':
+            commas.append(match.start())
+        else:
+            if token.upper() == 'SELECT':
+                clauses = []
+            clauses.append( (' '.join(token.upper().split()), match.start(), match.end()) )
+    return clauses, commas
+
+def select_columns(query):
+    """Return the columns of the table that the main query selects as they
+       are, by the name of the column of the result."""
+
+    clauses, commas = query_clauses(query)
+    keywords = [keyword for keyword, start, end in clauses]
+    if 'FROM' not in keywords:
+        return {}
+
+    start, end = clauses[0][2], clauses[keywords.index('FROM')][1]
+    bounds = [start] + [comma + 1 for comma in commas if start < comma < end] + [end + 1]
+    columns = {}
+    for first, last in zip(bounds[:-1], bounds[1:]):
+        match = SELECT_COLUMN.match(query[first:last-1].strip())
+        if match:
+            columns[(match.group(3) or match.group(2)).upper()] = match.group(1)
+    return columns
+
+def add_conditions(query, conditions):
+    """Return the query with the conditions added to the end of its WHERE
+       clause, before the clauses that group or order its rows; or None if
+       the clause is not a plain list of conditions that all apply."""
+
+    clauses, commas = query_clauses(query)
+    keywords = [keyword for keyword, start, end in clauses]
+    position = len(query)
+    for keyword, start, end in clauses:
+        if keyword in ('GROUP BY', 'ORDER BY'):
+            position = start
+            break
+    position = len(query[:position].rstrip())
+
+    if 'WHERE' not in keywords:
+        return '%s\n        WHERE  1 = 1 AND %s%s' % (query[:position], ' AND '.join(conditions),
+                                                      query[position:])
+    if [start for keyword, start, end in clauses if keyword == 'OR' and start < position]:
+        return None
+    return '%s AND %s%s' % (query[:position], ' AND '.join(conditions), query[position:])
+
+def filter_condition(column, filters, prefix):
+    """Translate the include and exclude lists of a filter into a condition
+       on the column, using bind variables for the patterns.
+
+       The condition never drops a row that the filter would allow, but it
+       may keep rows that it would not: patterns that may not mean the same
+       to Oracle are left out, and the filter is still applied to the rows
+       that are fetched."""
+
+    if filters is None:
+        return None, {}
+
+    include_list, exclude_list = filters
+    conditions, binds = [], {}
+    portable = lambda f: PORTABLE_PATTERN.match(f.pattern) and '(?' not in f.pattern \
+                                                           and '[:' not in f.pattern
+    if not include_list:
+        return '1 = 0', {}
+
+    if not [f for f in include_list if not portable(f)]:
+        matches = []
+        for index, f in enumerate(include_list):
+            binds['%s_i%d' % (prefix, index)] = f.pattern
+            matches.append("REGEXP_LIKE(TRIM(%s), :%s_i%d, 'i')" % (column, prefix, index))
+        conditions.append('(%s)' % ' OR '.join(matches))
+
+    for index, f in enumerate(exclude_list):
+        if portable(f):
+            binds['%s_x%d' % (prefix, index)] = f.pattern
+            conditions.append("NOT REGEXP_LIKE(TRIM(%s), :%s_x%d, 'i')" % (column, prefix, index))
+
+    return ' AND '.join(conditions) or None, binds
+
+def as_of_scn(query):
+    """Return the query, reading each dictionary view as of the :scn bind
+       variable."""
+    return DICTIONARY_VIEW.sub(r'\1 AS OF SCN :scn', query)
+
+def changed_condition(column, types):
+    """Return a condition that the column names an object of one of the
+       given types that was altered since the :since bind variable."""
+
+    return """%s IN (SELECT object_name FROM sys.user_objects
+                    WHERE  object_type IN ('%s')
+                    AND    last_ddl_time >= TO_DATE(:since, '%s'))""" % \
+           (column, "', '".join(types), TIMESTAMP_FORMAT)
@@ -9,6 +9,7 @@ class CheckConstraintBuilder(object):
 
     DbClass = CheckConstraint
     XmlTag  = 'check-constraint'
+    Parents = [('TABLE_NAME', 'table')]
 
     Query = """
         WITH cons_cols AS (
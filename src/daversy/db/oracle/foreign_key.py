@@ -6,9 +6,12 @@ class ForeignKeyColumnBuilder(object):
 
     DbClass = ForeignKeyColumn
     XmlTag  = 'foreign-key-column'
+    Parents = [('CONSTRAINT_NAME', 'foreign-key'), ('KEY_TABLE', 'table'),
+               ('REFERENCE_TABLE', 'table')]
 
     Query = """
-        SELECT k.constraint_name, kc.position, kc.column_name AS key_column, rc.column_name AS reference_column
+        SELECT k.constraint_name, kc.position, kc.column_name AS key_column, rc.column_name AS reference_column,
+               k.table_name AS key_table, r.table_name AS reference_table
         FROM   sys.user_constraints k, sys.user_constraints r,
                sys.user_cons_columns kc, sys.user_cons_columns rc
         WHERE  k.constraint_type = 'R'
@@ -24,7 +27,9 @@ class ForeignKeyColumnBuilder(object):
         ('CONSTRAINT_NAME',  Property('constraint-name', exclude=True)),
         ('POSITION',         Property('position',        exclude=True)),
         ('KEY_COLUMN',       Property('name')),
-        ('REFERENCE_COLUMN', Property('reference'))
+        ('REFERENCE_COLUMN', Property('reference')),
+        ('KEY_TABLE',        Property('key-table',       exclude=True)),
+        ('REFERENCE_TABLE',  Property('reference-table', exclude=True))
     )
 
     @staticmethod
@@ -38,6 +43,7 @@ class ForeignKeyBuilder(object):
 
     DbClass = ForeignKey
     XmlTag  = 'foreign-key'
+    Parents = [('KEY_TABLE', 'table'), ('REFERENCE_TABLE', 'table')]
 
     Query = """
         SELECT k.constraint_name, k.table_name AS key_table, r.table_name AS reference_table,
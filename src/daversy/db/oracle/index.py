@@ -6,6 +6,7 @@ class IndexColumnBuilder(object):
 
     DbClass = IndexColumn
     XmlTag  = 'index-column'
+    Parents = [('TABLE_NAME', 'table'), ('INDEX_NAME', 'index')]
 
     Query = """
         SELECT c.column_name, lower(c.descend) AS sort, i.index_name,
@@ -45,6 +46,8 @@ class IndexBuilder(object):
 
     DbClass = Index
     XmlTag  = 'index'
+    DbType  = ['INDEX']
+    Parents = [('TABLE_NAME', 'table')]
 
     Query = """
         SELECT i.index_name, i.table_name,
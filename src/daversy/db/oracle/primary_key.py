@@ -6,6 +6,7 @@ class PrimaryKeyColumnBuilder(object):
 
     DbClass = PrimaryKeyColumn
     XmlTag  = 'constraint-column'
+    Parents = [('TABLE_NAME', 'table'), ('CONSTRAINT_NAME', 'primary-key')]
 
     PropertyList = odict(
         ('COLUMN_NAME',     Property('name')),
@@ -35,6 +36,7 @@ class PrimaryKeyBuilder(object):
 
     DbClass = PrimaryKey
     XmlTag  = 'primary-key'
+    Parents = [('TABLE_NAME', 'table')]
 
     Query = """
         SELECT c.constraint_name AS name, c.table_name,
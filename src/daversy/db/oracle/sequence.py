@@ -10,6 +10,7 @@ class SequenceBuilder(object):
 
     DbClass = Sequence
     XmlTag  = 'sequence'
+    DbType  = ['SEQUENCE']
 
     Query = """
         SELECT sequence_name, increment_by, min_value, max_value,
@@ -1,6 +1,4 @@
-from StringIO import StringIO
-
-schema = StringIO("""
+schema = """
 <xsd:schema xmlns:xsd="http://www.w3.org/2001/XMLSchema"
             xmlns="http://www.daversy.org/schemas/state/oracle"
             targetNamespace="http://www.daversy.org/schemas/state/oracle"
@@ -13,6 +11,11 @@ schema = StringIO("""
       <xsd:pattern value="[a-zA-Z0-9_#$=]{1,30}|generated:[a-z0-9]{40}" />
     </xsd:restriction>
   </xsd:simpleType>
+  <xsd:simpleType name="DigestType">
+    <xsd:restriction base="xsd:normalizedString">
+      <xsd:pattern value="[a-f0-9]{40}" />
+    </xsd:restriction>
+  </xsd:simpleType>
   <xsd:simpleType name="ContentType">
     <xsd:restriction base="xsd:string">
       <xsd:whiteSpace value="preserve" />
@@ -133,6 +136,7 @@ schema = StringIO("""
         <xsd:attribute name="name" type="NameType" use="required" />
         <xsd:attribute name="source" type="ContentType" />
         <xsd:attribute name="invalid" type="xsd:boolean" />
+        <xsd:attribute name="digest" type="DigestType" />
       </xsd:extension>
     </xsd:simpleContent>
   </xsd:complexType>
@@ -155,6 +159,7 @@ schema = StringIO("""
     <xsd:attribute name="iot" type="xsd:boolean" />
     <xsd:attribute name="on-commit-preserve-rows" type="xsd:boolean" />
     <xsd:attribute name="comment" type="ContentType" />
+    <xsd:attribute name="digest" type="DigestType" />
   </xsd:complexType>
   <xsd:complexType name="SequenceType">
     <xsd:attribute name="name" type="NameType" use="required" />
@@ -164,6 +169,7 @@ schema = StringIO("""
     <xsd:attribute name="cache-size" type="xsd:positiveInteger" />
     <xsd:attribute name="cycle-after-last" type="xsd:boolean" />
     <xsd:attribute name="guaranteed-order" type="xsd:boolean" />
+    <xsd:attribute name="digest" type="DigestType" />
   </xsd:complexType>
   <xsd:complexType name="IndexType">
     <xsd:sequence>
@@ -174,6 +180,7 @@ schema = StringIO("""
     <xsd:attribute name="unique" type="xsd:boolean" use="required" />
     <xsd:attribute name="bitmap" type="xsd:boolean" />
     <xsd:attribute name="compress" type="xsd:positiveInteger" />
+    <xsd:attribute name="digest" type="DigestType" />
   </xsd:complexType>
   <xsd:complexType name="ForeignKeyType">
       <xsd:sequence>
@@ -184,6 +191,7 @@ schema = StringIO("""
       <xsd:attribute name="reference-table" type="NameType" use="required" />
       <xsd:attribute name="delete-rule" type="ReferentialDeleteEnum" use="required"/>
       <xsd:attribute name="defer-type" type="DeferTypeEnum" />
+      <xsd:attribute name="digest" type="DigestType" />
   </xsd:complexType>
   <xsd:complexType name="MaterializedViewType">
     <xsd:simpleContent>
@@ -196,6 +204,7 @@ schema = StringIO("""
         <xsd:attribute name="build-mode" type="xsd:string" />
         <xsd:attribute name="query-rewrite" type="xsd:string" />
         <xsd:attribute name="source" type="ContentType" />
+        <xsd:attribute name="digest" type="DigestType" />
       </xsd:extension>
     </xsd:simpleContent>
   </xsd:complexType>
@@ -207,6 +216,7 @@ schema = StringIO("""
     <xsd:attribute name="name" type="NameType" use="required" />
     <xsd:attribute name="definition" type="ContentType" />
     <xsd:attribute name="comment" type="ContentType" />
+    <xsd:attribute name="digest" type="DigestType" />
   </xsd:complexType>
   <xsd:complexType name="TriggerType">
     <xsd:simpleContent>
@@ -215,6 +225,7 @@ schema = StringIO("""
         <xsd:attribute name="object-type" type="TriggerObjectEnum" use="required" />
         <xsd:attribute name="object-name" type="NameType" use="required" />
         <xsd:attribute name="definition" type="ContentType" />
+        <xsd:attribute name="digest" type="DigestType" />
       </xsd:extension>
     </xsd:simpleContent>
   </xsd:complexType>
@@ -237,7 +248,10 @@ schema = StringIO("""
         <xsd:element name="materialized-view" type="MaterializedViewType" minOccurs="0" maxOccurs="unbounded" />
       </xsd:sequence>
       <xsd:attribute name="name" type="xsd:normalizedString" use="required" />
+      <xsd:attribute name="scn" type="BigInteger" />
+      <xsd:attribute name="extracted" type="xsd:dateTime" />
+      <xsd:attribute name="digest" type="DigestType" />
     </xsd:complexType>
   </xsd:element>
 </xsd:schema>
-""")
+"""
@@ -12,6 +12,7 @@ class TableBuilder(object):
 
     DbClass = Table
     XmlTag  = 'table'
+    DbType  = ['TABLE']
 
     Query = """
         SELECT t.table_name, t.temporary, NVL2(t.iot_type, 'Y', 'N') AS iot, c.comments,
@@ -1,16 +1,21 @@
+import re
 from daversy.utils import *
 from daversy.db.object import Trigger
+from connection import cx_Oracle, TIMESTAMP_FORMAT
+
+# the name of the trigger in its DDL, once the owner has been removed
+TRIGGER_NAME = re.compile(r'\bTRIGGER\s+"([^"]+)"')
 
 class TriggerBuilder(object):
     """Represents a builder for a trigger."""
 
     DbClass = Trigger
     XmlTag  = 'trigger'
+    DbType  = ['TRIGGER']
 
     Query = """
         SELECT trigger_name, table_name, lower(base_object_type) AS type,
-               replace(dbms_metadata.get_ddl('TRIGGER', trigger_name),
-                       '"' || user || '".') AS definition
+               NULL AS definition
         FROM   sys.user_triggers
         ORDER BY trigger_name
     """
@@ -18,14 +23,70 @@ class TriggerBuilder(object):
         ('TRIGGER_NAME', Property('name')),
         ('TYPE',         Property('object-type')),
         ('TABLE_NAME',   Property('object-name')),
-        ('DEFINITION',   Property('definition', None, lambda x: x.read(), cdata=True))
+        ('DEFINITION',   Property('definition', cdata=True))
     )
 
+    # The DDL of all the triggers (or of those altered since a given time)
+    # is fetched through a single metadata handle, rather than with a call
+    # to dbms_metadata.get_ddl per trigger (which opens a handle of its own
+    # each time). It is the same DDL, the triggers are separated by a NUL
+    # character.
+    DefinitionQuery = """
+        DECLARE
+          handle      NUMBER;
+          transform   NUMBER;
+          ddl         CLOB;
+          definitions CLOB;
+        BEGIN
+          handle := dbms_metadata.open('TRIGGER');
+          dbms_metadata.set_filter(handle, 'SCHEMA', USER);
+          IF :since IS NOT NULL THEN
+            dbms_metadata.set_filter(handle, 'NAME_EXPR',
+              'IN (SELECT object_name FROM sys.user_objects
+                   WHERE  object_type = ''TRIGGER''
+                   AND    last_ddl_time >= TO_DATE(' || dbms_assert.enquote_literal(:since) ||
+                                                 ', ''%s''))');
+          END IF;
+          transform := dbms_metadata.add_transform(handle, 'DDL');
+          dbms_metadata.set_transform_param(transform, 'SQLTERMINATOR', true);
+          dbms_lob.createtemporary(definitions, true);
+          LOOP
+            ddl := dbms_metadata.fetch_clob(handle);
+            EXIT WHEN ddl IS NULL;
+            dbms_lob.append(definitions, replace(ddl, '"' || USER || '".') || chr(0));
+          END LOOP;
+          dbms_metadata.close(handle);
+          :definitions := definitions;
+        END;""" % TIMESTAMP_FORMAT
+
+    # the properties that the custom query reads (see DatabaseState._carry_over)
+    CustomProperties = ['definition']
+
     @staticmethod
     def addToState(state, trigger):
-        trigger.definition = trim_spaces(trigger.definition)
         state.triggers[trigger.name] = trigger
 
+    @staticmethod
+    def customQuery(cursor, state, builder, filters=None, since=None):
+        binds = {'definitions': cursor.var(cx_Oracle.CLOB), 'since': since}
+        cursor.execute(builder.DefinitionQuery, binds)
+
+        definitions = binds['definitions'].getvalue()
+        if hasattr(definitions, 'read'):
+            definitions = definitions.read()
+        for definition in (definitions or '').split('\0'):
+            match = TRIGGER_NAME.search(definition)
+            trigger = match and state.triggers.get(match.group(1))
+            if trigger:
+                # the same value as the Property of the definition would set
+                try:
+                    definition = unicode(definition)
+                except UnicodeDecodeError:
+                    definition = definition.decode('utf-8')
+                trigger.definition = trim_spaces(definition.replace('\x00', '').strip())
+
+        cursor.close()
+
     @staticmethod
     def createSQL(trigger):
         return trigger.definition + '\n\n'
@@ -6,6 +6,7 @@ class UniqueKeyColumnBuilder(object):
 
     DbClass = UniqueKeyColumn
     XmlTag  = 'constraint-column'
+    Parents = [('TABLE_NAME', 'table'), ('CONSTRAINT_NAME', 'unique-key')]
 
     Query = """
         SELECT cols.column_name, c.constraint_name, c.table_name, cols.position
@@ -35,6 +36,7 @@ class UniqueKeyBuilder(object):
 
     DbClass = UniqueKey
     XmlTag  = 'unique-key'
+    Parents = [('TABLE_NAME', 'table')]
 
     Query = """
         SELECT c.constraint_name AS name, c.table_name,
@@ -7,6 +7,7 @@ class ViewBuilder(object):
 
     DbClass = View
     XmlTag  = 'view'
+    DbType  = ['VIEW']
 
     Query = """
         SELECT v.view_name, v.text, c.comments
@@ -0,0 +1,456 @@
+import os, re, json, zlib, marshal, sqlite3, decimal, datetime
+from daversy.utils import atomic_write
+
+# a restricted query, as returned by the restrict method of a connection
+RESTRICTED = re.compile(r'^SELECT \* FROM \((.*)\) WHERE .*$', re.S)
+BIND       = re.compile(r':\w+')
+LITERAL    = re.compile(r"'[^']*'")
+NOTHING    = re.compile(r'^\s*1\s*=\s*0\s*$')
+CLAUSE     = re.compile(r'\s+(GROUP|ORDER)\s+BY\b', re.I)
+OPENED     = re.compile(r'\s+WHERE\s+1\s*=\s*1(?=\s+(GROUP|ORDER)\s+BY\b|\s*$)', re.I)
+AS_OF      = re.compile(r'\s+AS\s+OF\s+SCN\s+:scn\b', re.I)
+
+RAW_SUFFIX = '.dvsraw'
+RAW_MAGIC  = 'DVSRAW1\n'
+SQL_MAGIC  = 'SQLite format 3\0'
+
+# the values kept as they are in each format (SQLite only holds 64-bit
+# integers), the others are encoded
+RAW_TYPES  = (type(None), int, long, float, str, unicode)
+SQL_TYPES  = (type(None), float, str, unicode)
+SQL_MIN    = -2**63
+SQL_MAX    = 2**63 - 1
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+class Dictionary(object):
+    """The rows that a database returned for the queries of the builders,
+       kept in a file so that a state can be extracted without the database.
+
+       Each statement is kept without the conditions that restrict it with
+       bind variables (see unrestricted). A .dvsraw file is a compressed,
+       marshalled list of the values of each column, which is compact and
+       quick to load. Any other file is a SQLite database, where the rows of
+       each statement are kept in a table of their own, named after the id
+       of the statement: they can thus be replaced with synthetic ones using
+       plain SQL.
+
+       The values that a format cannot hold as they are (such as Decimal
+       values, or numbers beyond the integers of SQLite) are kept as a tag
+       and a text: a (tag, text) tuple in a .dvsraw file, and a BLOB of the
+       tag followed by the text in SQLite (see encode_value)."""
+
+    def __init__(self):
+        self.results    = {}
+        self.properties = {}
+
+    def get(self, statement):
+        result = self.results.get(unrestricted(statement))
+        if result is None:
+            raise LookupError('No recorded rows for the statement:\n%s' % statement)
+        return result
+
+    def put(self, statement, columns, rows, values):
+        self.results[unrestricted(statement)] = (columns, rows, values)
+
+    @staticmethod
+    def is_dictionary(location):
+        if not os.path.isfile(location):
+            return False
+        stream = file(location, 'rb')
+        try:
+            header = stream.read(len(SQL_MAGIC))
+        finally:
+            stream.close()
+        return header.startswith(RAW_MAGIC) or header == SQL_MAGIC
+
+    @classmethod
+    def load(cls, location):
+        if not os.path.exists(location):
+            raise IOError('Unable to open the dictionary %s' % location)
+
+        dictionary = cls()
+        if location.endswith(RAW_SUFFIX):
+            dictionary._load_raw(location)
+        else:
+            dictionary._load_sqlite(location)
+        return dictionary
+
+    def save(self, location):
+        # a save that fails keeps the previous dictionary
+        if location.endswith(RAW_SUFFIX):
+            atomic_write(location, self._save_raw)
+        else:
+            atomic_write(location, self._save_sqlite)
+
+    def _load_raw(self, location):
+        stream = file(location, 'rb')
+        try:
+            if stream.read(len(RAW_MAGIC)) != RAW_MAGIC:
+                raise IOError('%s is not a dictionary' % location)
+            self.properties, results = marshal.loads(zlib.decompress(stream.read()))
+        finally:
+            stream.close()
+
+        for statement, columns, values, variables in results:
+            values = [decode_raw(column) for column in values]
+            self.results[statement] = (columns, zip(*values), decode_raw(variables))
+
+    def _save_raw(self, location):
+        results = []
+        for statement, (columns, rows, variables) in sorted(self.results.items()):
+            values = rows and zip(*rows) or [()] * len(columns or [])
+            values = [encode_raw(column) for column in values]
+            results.append( (statement, columns, values, encode_raw(variables)) )
+
+        stream = file(location, 'wb')
+        try:
+            stream.write(RAW_MAGIC)
+            stream.write(zlib.compress(marshal.dumps((self.properties, results)), 6))
+        finally:
+            stream.close()
+
+    def _load_sqlite(self, location):
+        database = sqlite3.connect(location)
+        database.text_factory = str
+        try:
+            for name, value in database.execute('SELECT name, value FROM properties'):
+                self.properties[name] = json.loads(value)
+
+            for id, statement, columns, values in database.execute(
+                    'SELECT id, statement, columns, variables FROM statements'):
+                rows = []
+                if columns is not None:
+                    rows = database.execute('SELECT * FROM rows_%d ORDER BY rowid' % id).fetchall()
+                    rows = [decode_row(row) for row in rows]
+                    columns = json.loads(columns)
+                # the encoded values of the variables are read back as lists
+                values = [isinstance(value, list) and tuple(value) or value
+                          for value in json.loads(values)]
+                self.results[statement] = (columns, rows, decode_raw(values))
+        finally:
+            database.close()
+
+    def _save_sqlite(self, location):
+        if os.path.exists(location):
+            os.remove(location)
+
+        database = sqlite3.connect(location)
+        database.text_factory = str
+        try:
+            database.execute('CREATE TABLE properties (name TEXT PRIMARY KEY, value TEXT)')
+            database.execute('CREATE TABLE statements (id INTEGER PRIMARY KEY, statement TEXT UNIQUE, '
+                             'columns TEXT, variables TEXT)')
+            for name, value in self.properties.items():
+                database.execute('INSERT INTO properties VALUES (?, ?)', (name, json.dumps(value)))
+
+            for id, (statement, (columns, rows, values)) in enumerate(sorted(self.results.items())):
+                database.execute('INSERT INTO statements VALUES (?, ?, ?, ?)',
+                                 (id, statement, columns is not None and json.dumps(columns) or None,
+                                  json.dumps(encode_raw(values))))
+                if columns is None:
+                    continue
+                database.execute('CREATE TABLE rows_%d (%s)' % (id, ', '.join(['"%s"' % c for c in columns])))
+                database.executemany('INSERT INTO rows_%d VALUES (%s)' % (id, ', '.join('?' * len(columns))),
+                                     [encode_row(row) for row in rows])
+            database.commit()
+        finally:
+            database.close()
+
+#############################################################################
+
+class OfflineConnection(object):
+    """A connection that answers the queries from a dictionary instead of a
+       database. A restricted query returns the rows whose columns pass the
+       filters, so that the other rows are not even converted; but the rows
+       are not restricted to the objects altered since a given time."""
+
+    def __init__(self, dictionary, arraysize=None):
+        self.dictionary = dictionary
+        self.arraysize  = arraysize or 500
+        for name, value in dictionary.properties.items():
+            setattr(self, name, value)
+
+    def cursor(self):
+        return OfflineCursor(self.dictionary, self.arraysize)
+
+    def restrict(self, query, columns, changes=(), since=None):
+        return query, RowFilter(columns)
+
+    def close(self):
+        pass
+
+class RowFilter(object):
+    """The filters of some of the columns of a query."""
+
+    def __init__(self, columns):
+        self.columns = [(column, filters) for column, filters in columns
+                                          if filters is not None]
+
+    def apply(self, columns, rows):
+        checks = [(columns.index(column), filters) for column, filters in self.columns
+                                                   if column in columns]
+        if not checks:
+            return rows
+        return [row for row in rows if not [index for index, filters in checks
+                                            if not is_allowed(row[index], filters)]]
+
+class OfflineCursor(object):
+    def __init__(self, dictionary, arraysize):
+        self.dictionary  = dictionary
+        self.arraysize   = arraysize
+        self.description = None
+        self.rows        = []
+        self.variables   = []
+
+    def var(self, *args, **kwargs):
+        variable = RecordedVariable()
+        self.variables.append(variable)
+        return variable
+
+    def execute(self, statement, *args, **kwargs):
+        columns, self.rows, values = self.dictionary.get(statement)
+        self.description = columns is not None and [(c,) for c in columns] or None
+        if args and isinstance(args[0], RowFilter):
+            self.rows = args[0].apply(columns, self.rows)
+        self.position    = 0
+        for variable, value in zip(self.variables, values):
+            variable.value = value
+
+    def fetchmany(self, count=None):
+        count = count or self.arraysize
+        rows  = self.rows[self.position:self.position + count]
+        self.position += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self.rows[self.position:]
+        self.position = len(self.rows)
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        pass
+
+class RecordedVariable(object):
+    """A variable bound to a statement, with the value that was recorded."""
+
+    def __init__(self):
+        self.value = None
+
+    def getvalue(self):
+        return self.value
+
+#############################################################################
+
+class DictionaryRecorder(object):
+    """A connection that keeps the rows of every query it runs in a
+       dictionary. It does not restrict queries either, so that the
+       dictionary holds all the rows of each builder."""
+
+    def __init__(self, connection, dictionary):
+        self.connection = connection
+        self.dictionary = dictionary
+        for name in ('started', 'scn'):
+            if getattr(connection, name, None) is not None:
+                dictionary.properties[name] = getattr(connection, name)
+                setattr(self, name, getattr(connection, name))
+
+        if hasattr(connection, 'snapshot_query'):
+            self.snapshot_query = connection.snapshot_query
+
+    def cursor(self):
+        return RecordingCursor(self.connection.cursor(), self.dictionary)
+
+    def close(self):
+        self.connection.close()
+
+class RecordingCursor(object):
+    """A cursor that fetches all the rows as soon as a query is executed,
+       and keeps them in a sink along with the values of the variables bound
+       to the statement: a list, for a ReplayConnection, or a dictionary."""
+
+    def __init__(self, cursor, sink):
+        self.cursor    = cursor
+        self.sink      = sink
+        self.rows      = []
+        self.variables = []
+
+    def var(self, *args, **kwargs):
+        variable = self.cursor.var(*args, **kwargs)
+        self.variables.append(variable)
+        return variable
+
+    def execute(self, statement, *args, **kwargs):
+        self.cursor.execute(statement, *args, **kwargs)
+        self.description = self.cursor.description
+        self.rows        = self.description and self.cursor.fetchall() or []
+        self.position    = 0
+
+        # LOBs can only be read while the session is open
+        values = []
+        for variable in self.variables:
+            value = variable.getvalue()
+            if hasattr(value, 'read'):
+                value = value.read()
+            values.append(value)
+
+        if isinstance(self.sink, list):
+            self.sink.append( (statement, self.description, self.rows, values) )
+        else:
+            columns = self.description and [c[0] for c in self.description] or None
+            self.sink.put(statement, columns, self.rows, values)
+
+    def fetchmany(self, count=None):
+        count = count or self.cursor.arraysize
+        rows  = self.rows[self.position:self.position + count]
+        self.position += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self.rows[self.position:]
+        self.position = len(self.rows)
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        self.cursor.close()
+
+#############################################################################
+
+def encode_value(value):
+    """Return the (tag, text) of a value that a dictionary file cannot hold
+       as it is."""
+
+    if isinstance(value, (int, long)):
+        return ('N', str(value))
+    if isinstance(value, decimal.Decimal):
+        return ('D', str(value))
+    if isinstance(value, datetime.datetime):
+        return ('T', value.strftime(TIME_FORMAT))
+    raise TypeError('Unable to keep a value of type %s in a dictionary'
+                    % value.__class__.__name__)
+
+def decode_value(tag, text):
+    if tag == 'N':
+        return int(text)
+    if tag == 'D':
+        return decimal.Decimal(text)
+    if tag == 'T':
+        return datetime.datetime.strptime(text, TIME_FORMAT)
+    raise ValueError('Unknown tag %r of a dictionary value' % tag)
+
+def encode_raw(values):
+    """Return the values, those that marshal does not support encoded."""
+    if not [value for value in values if type(value) not in RAW_TYPES]:
+        return values
+    return tuple([raw_value(value) for value in values])
+
+def raw_value(value):
+    if type(value) in RAW_TYPES:
+        return value
+    return encode_value(value)
+
+def decode_raw(values):
+    if not [value for value in values if type(value) is tuple]:
+        return values
+    return tuple([plain_value(value) for value in values])
+
+def plain_value(value):
+    if type(value) is tuple:
+        return decode_value(*value)
+    return value
+
+def encode_row(row):
+    """Return the row, its values that SQLite does not support encoded."""
+    if not [value for value in row if not is_sql_value(value)]:
+        return row
+    return tuple([sql_value(value) for value in row])
+
+def is_sql_value(value):
+    if type(value) in (int, long):
+        return SQL_MIN <= value <= SQL_MAX
+    return type(value) in SQL_TYPES
+
+def sql_value(value):
+    if is_sql_value(value):
+        return value
+    return buffer('%s%s' % encode_value(value))
+
+def decode_row(row):
+    if not [value for value in row if type(value) is buffer]:
+        return row
+    return tuple([row_value(value) for value in row])
+
+def row_value(value):
+    if type(value) is buffer:
+        return decode_value(value[0], str(value[1:]))
+    return value
+
+def unrestricted(statement):
+    """Return the statement without the conditions that restrict it with
+       bind variables (the push-down of filters, or of the objects altered
+       since a given time), or to no rows at all, and without the SCN it reads
+       the dictionary as of. Its rows are a superset of
+       those of the statement, which is all the builders need: they still
+       filter the rows they read."""
+
+    statement = AS_OF.sub('', statement)
+    match = RESTRICTED.match(statement)
+    if match:
+        statement = match.group(1)
+
+    result, position = [], 0
+    while True:
+        start = statement.find(' AND ', position)
+        if start < 0:
+            break
+        end = condition_end(statement, start + len(' AND '))
+        condition = statement[start + len(' AND '):end]
+        if BIND.search(LITERAL.sub('', condition)) or NOTHING.match(condition):
+            result.append(statement[position:start])
+        else:
+            result.append(statement[position:end])
+        position = end
+
+    result.append(statement[position:])
+    return OPENED.sub('', ''.join(result))
+
+def condition_end(statement, start):
+    """Return where the condition that starts at the given position ends: at
+       the next AND, GROUP BY, ORDER BY or closing parenthesis outside of it."""
+
+    depth, quoted, index = 0, False, start
+    while index < len(statement):
+        char = statement[index]
+        if char == "'":
+            quoted = not quoted
+        elif not quoted:
+            if char == '(':
+                depth += 1
+            elif char == ')':
+                if depth == 0:
+                    break
+                depth -= 1
+            elif depth == 0 and (statement.startswith(' AND ', index) or
+                                 CLAUSE.match(statement, index)):
+                break
+        index += 1
+    return index
+
+def is_allowed(value, filters):
+    """Return whether the name passes the filters, as it would once it is
+       the name of an object."""
+
+    if value is None:
+        return True
+    if isinstance(value, str):
+        value = value.decode('utf-8')
+
+    include_list, exclude_list = filters
+    name = unicode(value).strip()
+    return [f for f in include_list if f.match(name)] and \
+           not [f for f in exclude_list if f.match(name)]
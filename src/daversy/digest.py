@@ -0,0 +1,100 @@
+import hashlib
+
+def compute_digest(object, builders, child_digest=None, ignore=()):
+    """Return the SHA-1 digest of the canonical form of an object: the
+       properties that are saved, followed by the names and digests of its
+       sub-elements in name order. Objects that compare equal have the same
+       digest, however they were loaded.
+
+       The digests of the sub-elements are computed as well, unless a
+       child_digest function is given to look them up."""
+
+    if child_digest is None:
+        child_digest = lambda child: compute_digest(child, builders)
+
+    # the canonical form is hashed at once, which is quicker than hashing
+    # each of its parts in turn, and gives the same digest
+    tag, names, keys = canonical_form(builders[object.__class__], object.__class__)
+    parts = [tag]
+    for name in names:
+        value = object.get(name)
+        if value and name not in ignore:
+            parts.append('\0%s=%s' % (name, encode(value)))
+
+    for key in keys:
+        children = object[key]
+        parts.append('\0\0%s' % key)
+        for name in sorted(children.keys()):
+            parts.append('\0%s=%s' % (encode(name), child_digest(children[name])))
+
+    return hashlib.sha1(''.join(parts)).hexdigest()
+
+FORMS = {}
+
+def canonical_form(builder, dbclass):
+    """Return the tag, the names of the saved properties and the keys of the
+       sub-elements of the objects of a builder."""
+
+    if not FORMS.has_key(builder):
+        properties = getattr(builder, 'PropertyList', {}).values()
+        FORMS[builder] = (builder.XmlTag,
+                          [prop.name for prop in properties if not prop.exclude],
+                          getattr(dbclass, 'SubElements', {}).keys())
+    return FORMS[builder]
+
+def state_digest(state, builders, child_digest=None):
+    """Return the digest of a state. It only covers the objects of the state,
+       as its own properties (such as its name) describe where it comes
+       from."""
+
+    builder = builders[state.__class__]
+    ignore  = [prop.name for prop in getattr(builder, 'PropertyList', {}).values()]
+    return compute_digest(state, builders, child_digest, ignore)
+
+def tree_digest(object, builders):
+    """Return the digest of an object, computing (and keeping) those of the
+       object and of its sub-elements that it was not loaded with. Once they
+       are known, two objects differ only below the sub-elements whose
+       digests differ."""
+
+    def digest(object):
+        value = get_digest(object)
+        if value is None:
+            value = compute_digest(object, builders, digest)
+            set_digest(object, value)
+        return value
+
+    return digest(object)
+
+def add_digests(state, builders):
+    """Compute the digests of the objects of a state that are not known yet,
+       and that of the state."""
+
+    for key in state.SubElements.keys():
+        for item in state[key].values():
+            tree_digest(item, builders)
+    if get_digest(state) is None:
+        set_digest(state, state_digest(state, builders, get_digest))
+
+def get_digest(object):
+    """Return the digest the object was loaded with, if any."""
+    return object.__dict__.get('digest')
+
+def set_digest(object, digest):
+    # kept outside of the dictionary, so that it is not compared
+    object.__dict__['digest'] = digest
+
+def same_content(source, target):
+    """Return whether two objects are identical: by their digests if both
+       are known, so that a digest that differs is enough to tell them apart,
+       and by comparing them otherwise."""
+
+    source_digest, target_digest = get_digest(source), get_digest(target)
+    if source_digest is not None and target_digest is not None:
+        return source_digest == target_digest
+    return source == target
+
+def encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
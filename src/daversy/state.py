@@ -1,7 +1,23 @@
-import os, sys, re, tempfile, ConfigParser
+import os, sys, re, gzip, bz2, time, tempfile, hashlib, threading, ConfigParser
+from cStringIO import StringIO
 from os   import path
 from lxml import etree, _elementpath
+from multiprocessing      import cpu_count
+from multiprocessing.pool import ThreadPool
 from daversy.db import Database
+from daversy.utils import row_converter, odict, atomic_write
+from daversy.cache import StateCache
+from daversy.dictionary import Dictionary, OfflineConnection, DictionaryRecorder, \
+                               RecordingCursor, RecordedVariable
+from daversy.digest import compute_digest, state_digest, add_digests, get_digest, set_digest
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
 
 #############################################################################
 
@@ -12,38 +28,106 @@ class FileState:
     def can_save(self, location):
         return ':' not in location or re.match('^[a-z]:', location, re.I)
 
-    def load(self, location, filters = {}):
-        document = etree.parse(location)
-        db = self._detect_database(document.getroot().tag)
+    def load(self, location, filters = {}, **options):
+        db = self._detect_database(self._read_root(location).tag)
         if not db:
             raise LookupError('Unable to detect the provider')
 
         self._setup(db)
 
-        schema   = etree.XMLSchema( etree.parse(db.__xsd__) )
-        if not schema(document):
-          message = 'Document does not comply with schema.\n\n%s' % schema.error_log
-          raise etree.DocumentInvalid(message)
+        # the full schema is only checked in strict mode, otherwise a fast
+        # structural check is done while loading
+        schema = None
+        if options.get('strict'):
+            schema = compile_schema(db)
 
-        return self._load_element(document.getroot(), None,
-                                   db.__state__, filters)
+        # strict loads always parse the document, to validate it
+        cache = state = None
+        if options.get('cache', True) and not schema:
+            cache = StateCache()
+            state = cache.get(location, filters, db.__state__)
+            if state is not None and (get_digest(state) or not options.get('digests')):
+                return state
 
-    def save(self, state, location, info):
-        db = self._lookup_database(state.__class__)
+        if state is None:
+            try:
+                state = self._load_document(location, db, schema, filters)
+            except etree.XMLSyntaxError, e:
+                if not e.error_log.filter_domains(etree.ErrorDomains.SCHEMASV):
+                    raise
+                message = 'Document does not comply with schema.\n\n%s' % e.error_log
+                raise etree.DocumentInvalid(message)
+
+        # when asked for, the digest of every object is computed, and cached
+        # along with the state so that it is computed once for the file
+        if state is not None and options.get('digests'):
+            add_digests(state, self.db_mapping)
+        if cache and state is not None:
+            cache.put(location, filters, state)
+        return state
+
+    def read_objects(self, location, filters = {}, **options):
+        """Yield the state, and then (key, object) for each of its objects, without keeping them."""
+
+        db = self._detect_database(self._read_root(location).tag)
         if not db:
             raise LookupError('Unable to detect the provider')
 
         self._setup(db)
 
-        output = file(location, 'w')
-        dummy  = etree.Element('dummy')
-        self._save_element(dummy, state)
+        schema = None
+        if options.get('strict'):
+            schema = compile_schema(db)
 
-        root = dummy[0]
-        root.attrib['xmlns'] = db.__xmlns__
+        collections = self.tag_mapping[db.__state__]
+        toplevel    = [child.XmlTag for key, child in collections.values()]
+        digests     = not [tag for tag in filters if tag not in toplevel]
+
+        state = None
+        try:
+            for key, object, digest in self._read_document(location, db, schema, filters):
+                if key is None:
+                    state = object
+                    yield state
+                    continue
+                state[key][object.name] = True
+                if digests and digest:
+                    set_digest(object, digest)
+                yield key, object
+        except etree.XMLSyntaxError, e:
+            if not e.error_log.filter_domains(etree.ErrorDomains.SCHEMASV):
+                raise
+            message = 'Document does not comply with schema.\n\n%s' % e.error_log
+            raise etree.DocumentInvalid(message)
+
+    def read_name(self, location):
+        root = self._read_root(location)
+        if not self._detect_database(root.tag):
+            raise LookupError('Unable to detect the provider')
+
+        return root.get('name')
+
+    def read_digest(self, location):
+        """Return the content digest that the file was saved with, if any."""
 
-        etree.ElementTree(root).write(output, pretty_print=True)
-        output.close()
+        root = self._read_root(location)
+        if not self._detect_database(root.tag):
+            raise LookupError('Unable to detect the provider')
+
+        return root.get('digest')
+
+    def save(self, state, location, info, **options):
+        db = self._lookup_database(state.__class__)
+        if not db:
+            raise LookupError('Unable to detect the provider')
+
+        self._setup(db)
+
+        output = open_state(location, 'w', options.get('level'))
+        try:
+            self._save_document(output, state, db, options.get('digest'))
+        finally:
+            output.close()
 
     def save_sql(self, state, location, info, type='all'):
         db = self._lookup_database(state.__class__)
@@ -96,33 +180,168 @@ class FileState:
             self.xml_mapping[builder.XmlTag] = "{%s}%s" % (db.__xmlns__,
                                                             builder.XmlTag)
 
-    def _load_element(self, node, root, dbclass, filters):
-        if not self.db_mapping.has_key(dbclass):
-            return None
+        # index the properties, child tags and cdata tags of each object
+        self.prop_mapping, self.tag_mapping, self.cdata_mapping = {}, {}, {}
+        self.attr_mapping = {}
+        for builder in db.__builders__:
+            properties, children, cdata = [], {}, {}
+            for prop in getattr(builder, 'PropertyList', {}).values():
+                if not prop.exclude:
+                    properties.append(prop)
+            self.attr_mapping[builder.DbClass] = set([p.name for p in properties])
+            if hasattr(builder.DbClass, 'SubElements'):
+                for key, dbclass in builder.DbClass.SubElements.items():
+                    child = self.db_mapping.get(dbclass)
+                    if child:
+                        children[self.xml_mapping[child.XmlTag]] = (key, child)
+                for prop in properties:
+                    if prop.cdata:
+                        cdata["{%s}%s" % (db.__xmlns__, prop.name)] = prop
+            self.prop_mapping[builder.DbClass]  = properties
+            self.tag_mapping[builder.DbClass]   = children
+            self.cdata_mapping[builder.DbClass] = cdata
 
-        builder = self.db_mapping[dbclass]
-        if not node.tag == self.xml_mapping[builder.XmlTag]:
+        # the state and its objects may carry their content digest
+        for dbclass in [db.__state__] + db.__state__.SubElements.values():
+            self.attr_mapping[dbclass].add('digest')
+
+    def _read_root(self, location):
+        """Return the root element of the document, without its children."""
+        stream = open_state(location, 'rb')
+        try:
+            for event, node in etree.iterparse(stream, events=('start',),
+                                               huge_tree=True):
+                return node
+        finally:
+            stream.close()
+
+    def _load_document(self, location, db, schema, filters):
+        """Build the state, adding each top-level object to it as soon as it is read."""
+
+        # the saved digests hold, unless the filters may have changed the objects
+        collections = self.tag_mapping[db.__state__]
+        toplevel    = [child.XmlTag for key, child in collections.values()]
+        digests     = not [tag for tag in filters if tag not in toplevel]
+
+        state = None
+        for key, object, digest in self._read_document(location, db, schema, filters):
+            if key is None:
+                state = object
+                continue
+            state[key][object.name] = object
+            if digests and digest:
+                set_digest(object, digest)
+
+        # the digest of the state follows from those of the objects
+        if digests and state is not None:
+            objects = [item for key in state.SubElements.keys()
+                            for item in state[key].values()]
+            if not [item for item in objects if get_digest(item) is None]:
+                set_digest(state, state_digest(state, self.db_mapping, get_digest))
+
+        return state
+
+    def _read_document(self, location, db, schema, filters):
+        """Yield (None, state, None), and then (key, object, digest) for each top-level object."""
+
+        # each element is discarded once parsed, and the objects excluded by name
+        # as soon as their start tag is; the state only holds the root attributes
+        builder     = self.db_mapping[db.__state__]
+        collections = self.tag_mapping[db.__state__]
+        self.check  = schema is None
+
+        state = root = skipped = None
+        depth = 0
+        stream = open_state(location, 'rb')
+        try:
+            for event, node in etree.iterparse(stream, events=('start', 'end'),
+                                               schema=schema, huge_tree=True):
+                if event == 'start':
+                    depth += 1
+                    if depth == 1:
+                        root = node
+                        if self.check:
+                            self._check_element(root, builder, False)
+                    elif depth == 2 and filters and node.tag in collections:
+                        if self._is_excluded(node, collections[node.tag][1], filters):
+                            skipped = node
+                    continue
+
+                depth -= 1
+                if depth != 1:
+                    if skipped is not None and depth > 1:
+                        node.clear()
+                    continue
+
+                # the root attributes are complete by now
+                if state is None:
+                    state = self._load_attributes(root, None, builder, filters)
+                    yield None, state, None
+                    if state is None:
+                        return
+
+                if node is skipped:
+                    skipped = None
+                elif node.tag in collections:
+                    key, child = collections[node.tag]
+                    childObject = self._load_element(node, state, child, filters)
+                    if childObject:
+                        yield key, childObject, node.get('digest')
+                elif self.check and isinstance(node.tag, basestring):
+                    self._invalid(node, 'This element is not expected.')
+
+                # release the parsed sub-tree
+                node.clear()
+                while node.getprevious() is not None:
+                    del root[0]
+        finally:
+            stream.close()
+
+        if state is None:
+            yield None, self._load_attributes(root, None, builder, filters), None
+
+    def _load_element(self, node, root, builder, filters):
+        if self.check:
+            self._check_element(node, builder)
+
+        object = self._load_attributes(node, root, builder, filters)
+        if object is None:
             return None
 
-        # load attributes
+        # load sub-elements
+        children = self.tag_mapping[builder.DbClass]
+        if children:
+            state = root or object
+            for child in node:
+                if child.tag in children:
+                    key, child_builder = children[child.tag]
+                    if filters and self._is_excluded(child, child_builder, filters):
+                        continue
+                    childObject = self._load_element(child, state, child_builder, filters)
+                    if childObject:
+                        object[key][childObject.name] = childObject
+
+        return object
+
+    def _load_attributes(self, node, root, builder, filters):
         object = builder.DbClass()
         state  = root or object
-        if hasattr(builder, 'PropertyList'):
-            for prop in builder.PropertyList.values():
-                if prop.exclude:
-                    continue
-                object[prop.name] = prop.default
-                if prop.name in node.attrib:
-                    object[prop.name] = node.get(prop.name) or prop.default
-                    continue
-                if prop.cdata:
-                    if not hasattr(object, 'SubElements'):
-                        object[prop.name] = node.text or prop.default
-                    else:
-                        for sub in node:
-                            tag = '}' in sub.tag and sub.tag[sub.tag.index('}')+1:] or sub.tag
-                            if tag == prop.name:
-                                object[prop.name] = sub.text or prop.default
+        attrib = node.attrib
+        for prop in self.prop_mapping[builder.DbClass]:
+            object[prop.name] = prop.default
+            if prop.name in attrib:
+                object[prop.name] = attrib[prop.name] or prop.default
+                continue
+            if prop.cdata and not hasattr(object, 'SubElements'):
+                object[prop.name] = node.text or prop.default
+
+        # cdata properties of objects with sub-elements are child nodes
+        cdata = self.cdata_mapping[builder.DbClass]
+        if cdata:
+            for sub in node:
+                prop = cdata.get(sub.tag)
+                if prop and prop.name not in attrib:
+                    object[prop.name] = sub.text or prop.default
 
         # check if it is excluded
         if not is_allowed( object, filters.get(builder.XmlTag) ):
@@ -131,21 +350,97 @@ class FileState:
         if hasattr(builder, 'isAllowed') and not builder.isAllowed(state, object):
             return None
 
-        # load sub-elements
-        if hasattr(object, 'SubElements'):
-            for key, dbclass in object.SubElements.items():
-                for child in node:
-                    childObject = self._load_element(child, state, dbclass, filters)
-                    if childObject:
-                        object[key][childObject.name] = childObject
-
         return object
 
+    def _is_excluded(self, node, builder, filters):
+        # checked before anything else is read; nodes without a name are left to the object
+        tag_filters = filters.get(builder.XmlTag)
+        if tag_filters is None:
+            return False
+
+        name = node.get('name')
+        return bool(name) and not is_allowed({'name': name}, tag_filters)
+
+    def _check_element(self, node, builder, children=True):
+        # only the attributes and child elements that the builder knows are allowed
+        attributes = self.attr_mapping[builder.DbClass]
+        for name in node.attrib.keys():
+            if name not in attributes:
+                self._invalid(node, "The attribute '%s' is not allowed." % name)
+
+        if not node.tag == self.xml_mapping[builder.XmlTag]:
+            self._invalid(node, 'Expected is %s.' % self.xml_mapping[builder.XmlTag])
+
+        if children:
+            tags, cdata = self.tag_mapping[builder.DbClass], self.cdata_mapping[builder.DbClass]
+            for child in node:
+                if isinstance(child.tag, basestring) and child.tag not in tags \
+                                                     and child.tag not in cdata:
+                    self._invalid(child, 'This element is not expected.')
+
+    def _invalid(self, node, message):
+        message = 'Document does not comply with schema.\n\nline %s: ' \
+                  'Element \'%s\': %s' % (node.sourceline, node.tag, message)
+        raise etree.DocumentInvalid(message)
+
+    def _save_document(self, output, state, db, digest=False):
+        # each top-level object is serialized as soon as it is visited, with its digest if asked to
+        builder  = self.db_mapping[state.__class__]
+        root     = self._save_root(state, db)
+        digests  = {}
+        if digest:
+            for key in state.SubElements.keys():
+                for item in state[key].values():
+                    digests[id(item)] = compute_digest(item, self.db_mapping)
+            root.attrib['digest'] = state_digest(state, self.db_mapping,
+                                                 lambda item: digests[id(item)])
+        document = etree.ElementTree(root)
+        header   = self._serialize(document)
+        if not [key for key in state.SubElements.keys() if state[key]]:
+            output.write(header)
+            return
+
+        start, end = header[:-3] + '>', '\n</%s>\n' % builder.XmlTag
+        output.write(start)
+        for key in state.SubElements.keys():
+            for item in state[key].values():
+                node = self._save_element(root, item)
+                if digest:
+                    node.attrib['digest'] = digests[id(item)]
+                output.write(self._serialize(document)[len(start):-len(end)])
+                root.remove(node)
+        output.write(end)
+
+    def _save_root(self, object, db):
+        """Return a root node with the object attributes, under a dummy parent."""
+
+        builder = self.db_mapping[object.__class__]
+        dummy   = etree.Element('dummy')
+        root    = etree.SubElement(dummy, builder.XmlTag)
+        self._save_attributes(root, builder, object)
+        root.attrib['xmlns'] = db.__xmlns__
+        return root
+
+    def _serialize(self, document):
+        buffer = StringIO()
+        document.write(buffer, pretty_print=True)
+        return buffer.getvalue()
+
     def _save_element(self, node, object):
         builder = self.db_mapping[object.__class__]
         subnode = etree.SubElement(node, builder.XmlTag)
 
-        # save attributes
+        self._save_attributes(subnode, builder, object)
+
+        # save sub-elements
+        if hasattr(object, 'SubElements'):
+            for key in object.SubElements.keys():
+                for item in object[key].values():
+                    self._save_element(subnode, item)
+
+        return subnode
+
+    def _save_attributes(self, subnode, builder, object):
         if hasattr(builder, 'PropertyList'):
             for key, value in builder.PropertyList.items():
                 if not value.exclude and object[value.name]:
@@ -158,14 +453,160 @@ class FileState:
                             cdata = etree.SubElement(subnode, value.name)
                             cdata.text = etree.CDATA(object[value.name])
 
-        # save sub-elements
-        if hasattr(object, 'SubElements'):
-            for key in object.SubElements.keys():
-                for item in object[key].values():
-                    self._save_element(subnode, item)
+#############################################################################
+
+class DirectoryState(FileState):
+    """A state stored as a directory: state.xml, manifest.xml and a <tag>/<name>.xml per object."""
+
+    def can_load(self, location):
+        return path.isfile(path.join(location, MANIFEST_FILE))
+
+    def can_save(self, location):
+        return FileState.can_save(self, location) and \
+               (path.isdir(location) or location.endswith(('/', os.sep)))
+
+    def load(self, location, filters = {}, **options):
+        root = self._read_root(path.join(location, STATE_FILE))
+        db   = self._detect_database(root.tag)
+        if not db:
+            raise LookupError('Unable to detect the provider')
+
+        self._setup(db)
+        self.check = True
+
+        builder = self.db_mapping[db.__state__]
+        self._check_element(root, builder, False)
+        state = self._load_attributes(root, None, builder, filters)
+        if state is None:
+            return None
+
+        # select the objects before reading any of them
+        collections, selected = {}, []
+        for key, dbclass in state.SubElements.items():
+            child = self.db_mapping[dbclass]
+            collections[child.XmlTag] = (key, child)
+        for tag, name, filename, digest in self._read_manifest(location):
+            if tag not in collections:
+                raise etree.DocumentInvalid('Unknown tag in manifest: %s' % tag)
+            if is_allowed({'name': name}, filters.get(tag)):
+                selected.append( (tag, path.join(location, *filename.split('/'))) )
+
+        # parsing mostly releases the interpreter lock, the objects are then
+        # built in order, one batch at a time
+        jobs  = options.get('jobs') or cpu_count()
+        pool  = ThreadPool(jobs)
+        batch = 64 * jobs
+        try:
+            for start in range(0, len(selected), batch):
+                chunk = selected[start:start+batch]
+                nodes = pool.map(parse_shard, [name for tag, name in chunk])
+                for (tag, name), node in zip(chunk, nodes):
+                    key, child = collections[tag]
+                    childObject = self._load_element(node, state, child, filters)
+                    if childObject:
+                        state[key][childObject.name] = childObject
+        finally:
+            pool.close()
+
+        if options.get('digests'):
+            add_digests(state, self.db_mapping)
+        return state
+
+    def read_name(self, location):
+        return FileState.read_name(self, path.join(location, STATE_FILE))
+
+    def save(self, state, location, info, **options):
+        db = self._lookup_database(state.__class__)
+        if not db:
+            raise LookupError('Unable to detect the provider')
+
+        self._setup(db)
+
+        known = {}
+        if self.can_load(location):
+            for tag, name, filename, digest in self._read_manifest(location):
+                known[filename] = digest
+
+        manifest, used = etree.Element('manifest'), set()
+        for key in state.SubElements.keys():
+            for item in state[key].values():
+                builder  = self.db_mapping[item.__class__]
+                filename = self._shard_name(builder.XmlTag, item.name, used)
+
+                node = self._save_element(etree.Element('dummy'), item)
+                node.attrib['xmlns'] = db.__xmlns__
+                data   = self._serialize(etree.ElementTree(node))
+                digest = hashlib.sha1(data).hexdigest()
+
+                target = path.join(location, *filename.split('/'))
+                if known.get(filename) != digest or not path.isfile(target):
+                    self._write(target, data)
+
+                etree.SubElement(manifest, 'shard', tag=builder.XmlTag,
+                                 name=item.name, file=filename, digest=digest)
+
+        self._write(path.join(location, STATE_FILE),
+                    self._serialize(etree.ElementTree(self._save_root(state, db))))
+        self._write(path.join(location, MANIFEST_FILE),
+                    self._serialize(etree.ElementTree(manifest)))
+
+        # remove the objects that are gone, once the manifest no longer
+        # lists them
+        for filename in known:
+            target = path.join(location, *filename.split('/'))
+            if filename.lower() not in used and path.isfile(target):
+                os.remove(target)
+
+    def _read_manifest(self, location):
+        document = etree.parse(path.join(location, MANIFEST_FILE))
+        return [(node.get('tag'), node.get('name'), node.get('file'), node.get('digest'))
+                for node in document.getroot()]
+
+    def _shard_name(self, tag, name, used):
+        """Return a file name for the object, safe and unique on any platform."""
+
+        safe = re.sub('[^A-Za-z0-9_$#.-]', lambda m: '%%%02X' % ord(m.group()),
+                      name.encode('utf-8'))
+        filename, count = '%s/%s.xml' % (tag, safe), 1
+        while filename.lower() in used:
+            filename, count = '%s/%s~%d.xml' % (tag, safe, count), count + 1
+        used.add(filename.lower())
+        return filename
+
+    def _write(self, filename, data):
+        # an interrupted save never leaves a truncated file behind
+        directory = path.dirname(filename)
+        if not path.isdir(directory):
+            os.makedirs(directory)
+        atomic_write(filename, data)
+
+STATE_FILE    = 'state.xml'
+MANIFEST_FILE = 'manifest.xml'
+
+def parse_shard(filename):
+    parser = etree.XMLParser(huge_tree=True)
+    return etree.parse(filename, parser).getroot()
 
 #############################################################################
 
+class DictionaryState(object):
+    """A state built from the rows of a dictionary file, such as one of 'dvs snapshot'."""
+
+    def can_load(self, location):
+        return Dictionary.is_dictionary(location)
+
+    def can_save(self, location):
+        return False
+
+    def load(self, location, filters = {}, **options):
+        dictionary = Dictionary.load(location)
+        adapter    = dictionary.properties.get('adapter')
+        if not adapter or not Database.get(adapter):
+            raise LookupError('Unable to detect the provider')
+
+        options = dict(options, offline=dictionary)
+        return DatabaseState().load('%s:%s' % (adapter, location), filters, **options)
+
 class DatabaseState(object):
     def can_load(self, location):
         db, params = self._detect_database(location)
@@ -181,51 +622,392 @@ class DatabaseState(object):
 
         return Database.get(keys[0]), keys[1:]
 
-    def load(self, location, filters = {}):
+    def load(self, location, filters = {}, **options):
         if not self.can_load(location):
             return None
 
         db, params = self._detect_database(location)
 
+        # a snapshot pins all the sessions to the SCN of the first one
+        connect = {}
+        if options.get('snapshot'):
+            connect['snapshot'] = True
+        if options.get('arraysize'):
+            connect['arraysize'] = options['arraysize']
+
+        # the queries can be answered from (or recorded to) a dictionary file;
+        # the sessions of the workers (see _fetch_all) are opened with the
+        # worker option
+        connect_to = lambda **session: db.__conn__(params, **dict(connect, **session))
+        if options.get('offline'):
+            dictionary = options['offline']
+            if not isinstance(dictionary, Dictionary):
+                dictionary = Dictionary.load(dictionary)
+            connect_to = lambda **session: OfflineConnection(dictionary, options.get('arraysize'))
+        elif options.get('record'):
+            dictionary = options['record']
+            if not isinstance(dictionary, Dictionary):
+                dictionary = Dictionary()
+            dictionary.properties['adapter'] = db.__adapter__
+            connect_to = lambda **session: DictionaryRecorder(db.__conn__(params, **dict(connect, **session)),
+                                                              dictionary)
+
         state      = db.__state__()
-        connection = db.__conn__(params)
+        connection = connect_to()
+        if getattr(connection, 'scn', None) is not None:
+            connect['scn'] = connection.scn
+            state.scn      = unicode(connection.scn)
+        # against a base state, only the objects altered since it was
+        # extracted are read in full, the others are carried over from it;
+        # the time of the extraction is only kept when it is asked for (or
+        # against a base), since it changes on every extraction
+        base, since, changed = options.get('base'), None, {}
+        if hasattr(connection, 'started') and (options.get('incremental') or base is not None):
+            state.extracted = unicode(connection.started)
+        if base is not None and base.get('extracted') and hasattr(connection, 'changed_objects'):
+            since   = base.extracted
+            changed = self._changed_objects(db, connection.changed_objects(since))
+
+        # with several jobs, the queries run concurrently in sessions of their
+        # own, and the buffered rows are replayed here in the builder order
+        statistics = dict([(builder, FetchStatistics(builder.DbClass.__name__))
+                           for builder in db.__builders__])
+        jobs, results = options.get('jobs') or 1, {}
+        if jobs > 1:
+            results = self._fetch_all(db, connect_to, jobs, statistics, filters, since,
+                                      options.get('aggregate'))
 
         for builder in db.__builders__:
-            print "Extracting %s" % builder.DbClass.__name__
+            if not options.get('quiet'):
+                print "Extracting %s" % builder.DbClass.__name__
+            start, fetch = time.time(), statistics[builder].fetch
+            source = FetchConnection(connection, statistics[builder])
+            if builder in results:
+                source = ReplayConnection(results[builder])
             if hasattr(builder, 'Query'):
-                self._load_object(connection.cursor(), state,
-                                  builder, filters.get(builder.XmlTag))
+                self._load_object(source.cursor(), state, builder,
+                                  filters.get(builder.XmlTag),
+                                  self._query(connection, builder, filters, db, since))
             if hasattr(builder, 'customQuery'):
-                builder.customQuery(connection.cursor(), state, builder)
+                custom_query(builder, source.cursor(), state,
+                             filters.get(builder.XmlTag), since, options.get('aggregate'))
+            if since:
+                self._carry_over(db, state, base, builder, changed)
+            statistics[builder].build += time.time() - start - \
+                                         (statistics[builder].fetch - fetch)
+
+            # the caller may have seen enough of the state once a builder ran
+            if options.get('until') and options['until'](state, builder):
+                break
 
         connection.close()
+        if options.get('record') and not isinstance(options['record'], Dictionary):
+            dictionary.save(options['record'])
+
+        if options.get('statistics'):
+            print FETCH_HEADER
+            for builder in db.__builders__:
+                print statistics[builder]
+
+        # the state properties that are not read from the database
+        for builder in db.__builders__:
+            if builder.DbClass == db.__state__:
+                for prop in builder.PropertyList.values():
+                    state.setdefault(prop.name, prop.default)
+
+        if options.get('digests'):
+            add_digests(state, dict([(builder.DbClass, builder) for builder in db.__builders__]))
         return state
 
-    def _load_object(self, cursor, state, builder, filters):
-        cursor.execute(builder.Query)
+    def _fetch_all(self, db, connect_to, jobs, statistics, filters, since=None, aggregate=False):
+        # each session is a worker, and each custom query reads all its rows into an empty state
+        sessions, local = [], threading.local()
+        def fetch(builder):
+            if not hasattr(local, 'connection'):
+                local.connection = connect_to(worker=True)
+                sessions.append(local.connection)
+
+            recorder = RecordingConnection(FetchConnection(local.connection,
+                                                           statistics[builder]))
+            if hasattr(builder, 'Query'):
+                cursor = recorder.cursor()
+                cursor.execute(*self._query(local.connection, builder, filters, db, since))
+                cursor.close()
+            if hasattr(builder, 'customQuery'):
+                state = db.__state__()
+                if getattr(local.connection, 'scn', None) is not None:
+                    state.scn = unicode(local.connection.scn)
+                custom_query(builder, recorder.cursor(), state,
+                             filters.get(builder.XmlTag), since, aggregate)
+            return recorder.results
+
+        builders = [builder for builder in db.__builders__
+                            if hasattr(builder, 'Query') or hasattr(builder, 'customQuery')]
+        pool = ThreadPool(jobs)
+        try:
+            return dict(zip(builders, pool.map(fetch, builders, 1)))
+        finally:
+            pool.close()
+            for session in sessions:
+                session.close()
+
+    def _query(self, connection, builder, filters, db=None, since=None):
+        """Return the query of the builder and its bind variables, restricted if possible."""
+
+        query = builder.Query, {}
+        if hasattr(connection, 'restrict'):
+            query = self._restrict(connection, builder, filters, db, since)
+        if hasattr(connection, 'snapshot_query'):
+            query = connection.snapshot_query(*query)
+        return query
+
+    def _restrict(self, connection, builder, filters, db, since):
+        columns = []
+        for column, prop in builder.PropertyList.items():
+            if prop.name == 'name':
+                columns.append( (column, filters.get(builder.XmlTag)) )
+        for column, tag in getattr(builder, 'Parents', []):
+            columns.append( (column, filters.get(tag)) )
+
+        # the top level objects are always read in full, which keeps the dropped ones right
+        changes = []
+        if since and builder.DbClass not in db.__state__.SubElements.values():
+            types = self._object_types(db)
+            for column, tag in self._owners(builder):
+                if tag in types:
+                    changes.append( (column, types[tag]) )
 
-        # find the column position and names
+        return connection.restrict(builder.Query, columns, changes, since)
+
+    def _owners(self, builder):
+        """Return the columns of the builder that name an object, with the tag of that object."""
+
+        owners = [(column, builder.XmlTag) for column, prop in builder.PropertyList.items()
+                                           if prop.name == 'name']
+        return owners + getattr(builder, 'Parents', [])
+
+    def _object_types(self, db):
+        """Return the database object types of each tag."""
+        return dict([(builder.XmlTag, builder.DbType) for builder in db.__builders__
+                                                      if hasattr(builder, 'DbType')])
+
+    def _changed_objects(self, db, objects):
+        """Return the names of the altered objects for each tag."""
+
+        tags = {}
+        for tag, types in self._object_types(db).items():
+            for type in types:
+                tags.setdefault(type, []).append(tag)
+
+        changed = {}
+        for type, name in objects:
+            for tag in tags.get(type, []):
+                changed.setdefault(tag, set()).add(name)
+        return changed
+
+    def _carry_over(self, db, state, base, builder, changed):
+        # the objects that were not altered keep their sub-elements, and the CustomProperties
+        # that the custom query only reads for altered objects (such as the source code)
+        for key, dbclass in db.__state__.SubElements.items():
+            if dbclass == builder.DbClass:
+                break
+        else:
+            return
+
+        properties = builder.PropertyList
+        custom     = getattr(builder, 'CustomProperties', [])
+        for name, object in state[key].items():
+            previous = base[key].get(name)
+            if previous is None:
+                continue
+
+            altered = False
+            for column, tag in self._owners(builder):
+                if object.get(properties[column].name) in changed.get(tag, ()):
+                    altered = True
+            if altered:
+                continue
+
+            for subkey in getattr(dbclass, 'SubElements', {}).keys():
+                object[subkey] = copy_elements(previous[subkey])
+            for prop in custom:
+                if object.get(prop) is None:
+                    object[prop] = previous.get(prop)
+
+    def _load_object(self, cursor, state, builder, filters, query):
+        cursor.execute(*query)
+
+        # the properties of the columns, in order
         columnNames = [c[0] for c in cursor.description]
-        columnIndex = dict(map(None, columnNames, range(len(columnNames))))
+        convert     = row_converter(builder.DbClass, [builder.PropertyList[name]
+                                                      for name in columnNames])
 
         for row in cursor:
-            # set the object properties
-            newObject = builder.DbClass()
-            for name in columnNames:
-                setProperty = builder.PropertyList[name]
-                setProperty(newObject, row[columnIndex[name]])
-
+            newObject = convert(row)
             if is_allowed(newObject, filters):
                 builder.addToState(state, newObject)
 
         cursor.close()
 
+def custom_query(builder, cursor, state, filters, since, aggregate=False):
+    # only the code builders can aggregate what they read, when asked to
+    if aggregate and hasattr(builder, 'AggregateQuery'):
+        builder.customQuery(cursor, state, builder, filters, since, aggregate=True)
+    else:
+        builder.customQuery(cursor, state, builder, filters, since)
+
+def copy_elements(collection):
+    """Return a copy of the objects and their sub-elements, that the builders can change."""
+
+    result = odict()
+    for name, object in collection.items():
+        copy = object.__class__()
+        dict.update(copy, object)
+        for key in getattr(object.__class__, 'SubElements', {}).keys():
+            copy[key] = copy_elements(object[key])
+        result[name] = copy
+    return result
+
+class FetchStatistics(object):
+    """The round trips, rows, fetch time and build time of a builder."""
+
+    def __init__(self, name):
+        self.name   = name
+        self.trips  = self.rows = 0
+        self.fetch  = self.build = 0.0
+
+    def __str__(self):
+        return FETCH_FORMAT % (self.name, self.trips, self.rows, self.fetch, self.build)
+
+FETCH_FORMAT = '%-24s %8d %10d %9.2f %9.2f'
+FETCH_HEADER = '%-24s %8s %10s %9s %9s' % ('Builder', 'Trips', 'Rows', 'Fetch(s)', 'Build(s)')
+
+class FetchConnection(object):
+    """A connection that fetches in batches of the arraysize, and keeps the statistics."""
+
+    def __init__(self, connection, statistics):
+        self.connection = connection
+        self.statistics = statistics
+
+    def cursor(self):
+        return FetchCursor(self.connection.cursor(), self.statistics)
+
+class FetchCursor(object):
+    def __init__(self, cursor, statistics):
+        self.cursor     = cursor
+        self.statistics = statistics
+
+    def execute(self, statement, *args, **kwargs):
+        start = time.time()
+        self.cursor.execute(statement, *args, **kwargs)
+        self.description = self.cursor.description
+        self.statistics.trips += 1
+        self.statistics.fetch += time.time() - start
+
+    def __iter__(self):
+        while True:
+            start = time.time()
+            rows  = self.cursor.fetchmany()
+            self.statistics.fetch += time.time() - start
+            if not rows:
+                break
+            self.statistics.trips += 1
+            self.statistics.rows  += len(rows)
+            for row in rows:
+                yield row
+
+    def fetchall(self):
+        return list(self)
+
+    def var(self, *args, **kwargs):
+        return self.cursor.var(*args, **kwargs)
+
+    def close(self):
+        self.cursor.close()
+
+class RecordingConnection(object):
+    """A connection that keeps the rows and bound values of each query for a ReplayConnection."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.results    = []
+
+    def cursor(self):
+        return RecordingCursor(self.connection.cursor(), self.results)
+
+class ReplayConnection(object):
+    """A connection that returns the rows of a RecordingConnection, in the same order."""
+
+    def __init__(self, results):
+        self.results = list(results)
+
+    def cursor(self):
+        return ReplayCursor(self.results)
+
+class ReplayCursor(object):
+    def __init__(self, results):
+        self.results   = results
+        self.rows      = []
+        self.variables = []
+
+    def var(self, *args, **kwargs):
+        variable = RecordedVariable()
+        self.variables.append(variable)
+        return variable
+
+    def execute(self, statement, *args, **kwargs):
+        if not self.results or statement != self.results[0][0]:
+            raise LookupError('No recorded rows for the statement:\n%s' % statement)
+        expected, self.description, self.rows, values = self.results.pop(0)
+        for variable, value in zip(self.variables, values):
+            variable.value = value
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def close(self):
+        pass
+
+#############################################################################
+
+PROVIDERS = [ DirectoryState(), DictionaryState(), FileState(), DatabaseState() ]
+
 #############################################################################
 
-PROVIDERS = [ FileState(), DatabaseState() ]
+def open_gzip(location, mode, level):
+    # a fixed timestamp keeps the output identical for identical states
+    return gzip.GzipFile(location, mode, level or 6, mtime=0)
+
+def open_bz2(location, mode, level):
+    return bz2.BZ2File(location, mode, compresslevel=level or 9)
+
+def open_xz(location, mode, level):
+    if lzma is None:
+        raise IOError('The lzma module is required for %s' % location)
+    if 'r' in mode:
+        return lzma.LZMAFile(location, mode)
+    return lzma.LZMAFile(location, mode, preset=level or 6)
+
+COMPRESSORS = { '.gz': open_gzip, '.bz2': open_bz2, '.xz': open_xz }
+
+def open_state(location, mode, level=None):
+    """Open a state file, (de)compressing it as its extension tells."""
+
+    compressor = COMPRESSORS.get(path.splitext(location)[1].lower())
+    if not compressor:
+        return file(location, mode)
+    return compressor(location, mode, level)
 
 #############################################################################
 
+SCHEMAS = {}
+
+def compile_schema(db):
+    """Return the compiled XML schema of the database, compiled once per process."""
+    if not SCHEMAS.has_key(db):
+        SCHEMAS[db] = etree.XMLSchema( etree.XML(db.__xsd__) )
+    return SCHEMAS[db]
+
 def create_filter(filename, included_tags, excluded_tags):
     config = ConfigParser.ConfigParser()
     if not config.read(filename):
@@ -1,8 +1,9 @@
 #!/usr/bin/env python
 import os, sys, re, datetime, ConfigParser, time, shutil
-import subprocess, glob, optparse, cStringIO, tempfile
+import subprocess, glob, optparse, tempfile
 
 from daversy.utils                import get_uuid4
+from daversy.command.compare      import Compare, format_change
 from daversy.db.oracle.connection import DEFAULT_NLS_LANG
 from lxml                         import etree
 
@@ -402,18 +403,27 @@ class DiffDb(DvsOracleTool):
         input, output = args
         self.quit( self.run(input, output) )
 
-    def run(self, input, output):
-        self.execute_cmd('comparing states', ['dvs', 'compare', input, output])
+    def run(self, input, output, log=None):
+        """Return 0 if the states are the same, 1 if they differ and 2 if
+           some of the changes need a migration. The changes are written to
+           the log, if any, as lines of the simple diff."""
 
-        if not self.output:
-            return 0
-
-        log = cStringIO.StringIO( self.output )
-        for line in log:
-            for elem in MIGRATION_NEEDED:
-                if elem in line and not ('@comment' in line and line.startswith('M')):
-                    return 2
-        return 1
+        self.message('comparing states')
+        status  = 0
+        changes = Compare().changes(input, output)
+        try:
+            for change in changes:
+                status = max(status, needs_migration(change) and 2 or 1)
+                if log:
+                    log.write(format_change(change).encode('utf-8') + '\n')
+                elif status == 2:
+                    break
+        except Exception, e:
+            self.message('FAILED: comparing %s with %s' % (input, output))
+            print e
+            self.quit(CMDERR)
+        changes.close()
+        return status
 
 class MigrateDb(DvsOracleTool):
     def __main__(self):
@@ -511,18 +521,24 @@ class MigrateDb(DvsOracleTool):
                              ['dvs', 'copy', 'oracle:' + self.connectString,
                               self.migration_check])
 
-        differ = DiffDb()
-        return_val = differ.run(state, self.migration_check)
+        differ  = DiffDb()
+        changes = self.tempfile(ext='.txt')
+        log = open(changes, 'w')
+        try:
+            return_val = differ.run(state, self.migration_check, log)
+        finally:
+            log.close()
+        changes = self.read_file(changes)
 
         if return_val == 2:
             self.message('migration was not successful: migrated and target schemas differ.')
-            self.message(differ.output, None)
+            self.message(changes, None)
             self.execute_sql('marking unsuccessful migration',
                              REMOVESCHEMAVERSION_SQL % self.target_version)
             return return_val
         elif return_val == 1:
             self.message('warning: there were some code/comment changes!!')
-            self.message(differ.output, None)
+            self.message(changes, None)
 
         self.execute_sql('migrated successfully to [%s]' % self.target_version,
                          UPDATESCHEMA_SQL % (self.target_version, '** migration successful **'))
@@ -758,7 +774,12 @@ class SyncDb(DvsOracleTool):
                           self.latest_state])
 
         differ = DiffDb()
-        status = differ.run(self.current_state, self.latest_state)
+        changes = self.tempfile(ext='.txt')
+        log = open(changes, 'w')
+        try:
+            status = differ.run(self.current_state, self.latest_state, log)
+        finally:
+            log.close()
         if status == 0:
             self.message('no changes detected')
             return 0
@@ -809,13 +830,14 @@ class SyncDb(DvsOracleTool):
         if migration_changes:
             text += 'Migrations:\n\n' + '\n'.join(migration_changes) + '\n\n'
 
-        text += 'Schema Changes:\n\n' + differ.output + '\n\n\n\n'
+        changes = self.read_file(changes).strip()
+        text += 'Schema Changes:\n\n' + changes + '\n\n\n\n'
 
         previous_changelog = self.read_file(self.changelog)
         self.write_file(self.changelog, text + previous_changelog)
 
         self.write_file(self.change_commit, "build $ver$: %s => %s\n\n%s" % \
-            (self.current_version, self.next_version, differ.output))
+            (self.current_version, self.next_version, changes))
 
         self.message('updating the current state with latest version')
         os.remove(self.current_state)
@@ -880,6 +902,14 @@ class SyncDb(DvsOracleTool):
 
 MIGRATION_NEEDED = ['foreign-key', 'table', 'index', 'sequence', 'materialized-view']
 
+def needs_migration(change):
+    """Return whether a change of the objects with these tags needs a
+       migration, rather than just re-creating them; a comment does not."""
+
+    if change['op'] == 'M' and change['property'] == 'comment':
+        return False
+    return bool([tag for tag in change['path'] if tag in MIGRATION_NEEDED])
+
 SQLPLUS_EXEC = """
 WHENEVER SQLERROR EXIT FAILURE ROLLBACK;
 SET DEFINE off;
@@ -1,11 +1,11 @@
-import os, re, stat, subprocess, hashlib
+import os, re, stat, subprocess, hashlib, tempfile
 from UserDict import DictMixin
 
 class Property(object):
     def __init__(self, name, default=None, translator=None, exclude=False, cdata=False):
         self.name       = name
         self.default    = default
-        self.translator = translator or (lambda value: value)
+        self.translator = translator or identity
         self.exclude    = exclude
         self.cdata      = cdata
 
@@ -24,6 +24,41 @@ class Property(object):
         else:
             object[self.name] = None
 
+def identity(value):
+    return value
+
+def row_converter(dbclass, properties):
+    """Compile the properties, one per column of a row, into a function that
+       creates an object from a row. The values are set just as each of the
+       properties would set them, without a call per property."""
+
+    columns = []
+    for index, prop in enumerate(properties):
+        translator, default = prop.translator, prop.default
+        if translator is identity:
+            translator = None
+        if default is not None:
+            default = str(default)
+        columns.append( (index, prop.name, translator, default) )
+
+    def convert(row):
+        object = dbclass()
+        for index, name, translator, default in columns:
+            value = row[index]
+            if value:
+                if translator:
+                    value = translator(value)
+                if isinstance(value, str):
+                    value = value.decode('utf-8')
+                elif not isinstance(value, unicode):
+                    value = unicode(value)
+                object[name] = value.replace('\x00','').strip()
+            else:
+                object[name] = default
+        return object
+
+    return convert
+
 def generated_name(*text):
     return 'generated:'+hashlib.sha1('\n'.join([t.strip() for t in text])).hexdigest()
 
@@ -64,9 +99,27 @@ class odict(DictMixin):
         del self._data[key]
         self._keys.remove(key)
 
+    def __contains__(self, key):
+        return key in self._data
+
+    has_key = __contains__
+
     def keys(self):
         return list(self._keys)
 
+    def __iter__(self):
+        return iter(self._keys)
+
+    def iteritems(self):
+        for key in self._keys:
+            yield key, self._data[key]
+
+    def items(self):
+        return [(key, self._data[key]) for key in self._keys]
+
+    def values(self):
+        return [self._data[key] for key in self._keys]
+
     def copy(self):
         copyDict = odict()
         copyDict._data = self._data.copy()
@@ -82,6 +135,35 @@ def execute(cmd, cwd=None, env=None):
     del command
     return result, output
 
+def atomic_write(location, data):
+    """Replace the file with the data (a string, or a function that writes the
+       file at the path it is given) through a temporary file next to it, so
+       that a write that fails or is interrupted never leaves a partial file."""
+
+    handle, temp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(location)))
+    try:
+        stream = os.fdopen(handle, 'wb')
+        try:
+            if not callable(data):
+                stream.write(data)
+        finally:
+            stream.close()
+        if callable(data):
+            data(temp)
+
+        # the mode of a file created as usual, rather than that of mkstemp
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temp, 0666 & ~umask)
+
+        if os.name == 'nt' and os.path.exists(location):
+            os.remove(location)
+        os.rename(temp, location)
+    except:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
 def remove_recursive(location):
     try:
         for root, dirs, files in os.walk(location, topdown=False):